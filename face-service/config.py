@@ -11,6 +11,11 @@ class Settings(BaseSettings):
     MODEL_NAME: str = "ArcFace"
     DETECTOR_BACKEND: str = "retinaface"
 
+    # ONNX export of the recognition model, run via onnxruntime. Opt-in: the
+    # Docker image exports it at build time and sets this; elsewhere a missing
+    # file is exported on first start (needs tf2onnx). Empty → DeepFace/Keras.
+    ONNX_MODEL_PATH: str = ""
+
     # Similarity thresholds (cosine similarity: 1 = identical, 0 = completely different)
     THRESHOLD_HIGH: float = 0.85      # >= HIGH → confident match
     THRESHOLD_MEDIUM: float = 0.70    # >= MEDIUM < HIGH → likely match
@@ -19,15 +24,40 @@ class Settings(BaseSettings):
 
     # Image validation limits
     MAX_IMAGE_SIZE_BYTES: int = 10 * 1024 * 1024  # 10MB
+    MAX_IMAGE_PIXELS: int = 40_000_000  # 40MP — checked from the header, before decoding
     MIN_FACE_SIZE_PX: int = 48   # Minimum face bbox dimension
     MAX_FACES_PER_IMAGE: int = 10
 
     # Target dimensions for preprocessing
     TARGET_SIZE: int = 112  # ArcFace expects 112x112
 
+    # Accept embeddings as JSON float lists (deprecated — prefer base64-packed float32)
+    ALLOW_FLOAT_LIST_EMBEDDINGS: bool = True
+
     # Batch limits
     MAX_BATCH_SIZE: int = 50
 
+    # Embeddings cached by hash of the raw image bytes + bbox (0 disables)
+    EMBED_CACHE_SIZE: int = 10_000
+
+    # How long the /embed batcher waits to coalesce concurrent requests
+    EMBED_BATCH_MAX_WAIT_MS: int = 10
+
+    # /match skips norm computation, treating all embeddings as unit-norm.
+    # Only enable once every stored embedding comes from the normalizing embedder.
+    ASSUME_NORMALIZED_EMBEDDINGS: bool = False
+
+    # Number of prepared candidate matrices kept in the /match LRU cache
+    MATCH_CACHE_SIZE: int = 32
+
+    # Opt-in: candidate sets larger than this are cached int8-quantized, for a
+    # quarter of the memory. NumPy's integer matmul has no BLAS path, so it is
+    # slower per query than float32 — and can reorder close scores (0 disables)
+    QUANTIZE_MIN_CANDIDATES: int = 0
+
+    # Worker threads for CPU-bound detect/embed/match work (0 → os.cpu_count())
+    THREAD_POOL_SIZE: int = 0
+
     # API key for internal auth
     API_KEY: str = "local_face_engine_key"
 
@@ -3,17 +3,24 @@
 # Python microservice for face detection and embedding
 # =============================================================
 
+import functools
+import hmac
 import logging
+import os
 import time
-from typing import List
+from typing import Any, AsyncIterator, Callable, List, Optional, Tuple, Union
 
-from fastapi import FastAPI, HTTPException, Security, Depends, status
+import anyio
+import msgpack
+import orjson
+from fastapi import FastAPI, HTTPException, Security, Depends, status, File, Form, Request, UploadFile
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
 from config import settings
 from models.schemas import (
+    FaceBoundingBox,
     DetectRequest,
     DetectResponse,
     EmbedRequest,
@@ -26,8 +33,17 @@ from models.schemas import (
     HealthResponse,
 )
 from services.detector import detect_faces_in_image
-from services.embedder import generate_embedding
-from services.matcher import match_embedding_against_candidates
+from services.batcher import embed_batcher
+from services.embedder import (
+    EmbeddingResult,
+    cache_embedding,
+    generate_embeddings_batch,
+    iter_embeddings_batch,
+    load_embedding_model,
+    lookup_or_preprocess,
+)
+from services.preprocessor import decode_base64_bytes
+from services.matcher import match_embedding_against_candidates, decode_embedding_b64
 
 # Configure logging
 logging.basicConfig(
@@ -46,6 +62,7 @@ app = FastAPI(
     version=settings.VERSION,
     docs_url="/docs",
     redoc_url="/redoc",
+    default_response_class=ORJSONResponse,
 )
 
 # CORS — only allow internal service communication
@@ -61,13 +78,14 @@ app.add_middleware(
 # ---------------------------------------------------------------
 
 bearer_scheme = HTTPBearer()
+API_KEY_BYTES = settings.API_KEY.encode()
 
 
 async def verify_api_key(
     credentials: HTTPAuthorizationCredentials = Security(bearer_scheme),
 ) -> str:
-    """Validate Bearer API key for internal service auth."""
-    if credentials.credentials != settings.API_KEY:
+    """Validate Bearer API key for internal service auth (constant-time compare)."""
+    if not hmac.compare_digest(credentials.credentials.encode(), API_KEY_BYTES):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail={"success": False, "error": "Invalid API key"},
@@ -102,7 +120,9 @@ async def detect_faces(request: DetectRequest):
     Returns bounding boxes and confidence scores for all detected faces.
     """
     try:
-        faces, width, height, processing_ms = detect_faces_in_image(request.image_base64)
+        faces, width, height, processing_ms = await anyio.to_thread.run_sync(
+            detect_faces_in_image, request.image_base64
+        )
         return DetectResponse(
             success=True,
             faces=faces,
@@ -135,10 +155,11 @@ async def embed_face(request: EmbedRequest):
     Optionally accepts a bounding box to skip detection.
     """
     try:
-        embedding, face_confidence, face_quality, processing_ms = generate_embedding(
-            request.image_base64,
-            face_bbox=request.face_bbox,
+        start = time.time()
+        embedding, face_confidence, face_quality = await _embed_payload(
+            request.image_base64, request.face_bbox, decode_base64_bytes
         )
+        processing_ms = int((time.time() - start) * 1000)
         return EmbedResponse(
             success=True,
             embedding=embedding,
@@ -160,6 +181,25 @@ async def embed_face(request: EmbedRequest):
         )
 
 
+async def _embed_payload(
+    payload: Any,
+    face_bbox: Optional[FaceBoundingBox],
+    to_bytes: Optional[Callable[[Any], bytes]] = None,
+) -> Tuple[List[float], Optional[float], Optional[float]]:
+    """
+    Decode and preprocess one image in a worker thread (or hit the embedding
+    cache), then embed it through the shared dynamic batcher so concurrent
+    calls coalesce into one forward.
+    Returns (embedding, face_confidence, face_quality).
+    """
+    key, cached, face = await anyio.to_thread.run_sync(lookup_or_preprocess, payload, face_bbox, to_bytes)
+    if cached is not None:
+        return cached
+
+    embedding = await embed_batcher.embed(face.tensor)
+    return cache_embedding(key, embedding, face)
+
+
 # ---------------------------------------------------------------
 # POST /match
 # ---------------------------------------------------------------
@@ -175,11 +215,20 @@ async def match_faces(request: MatchRequest):
     via the Node.js embedding-store service instead.
     """
     try:
-        matches, processing_ms = match_embedding_against_candidates(
-            query_embedding=request.query_embedding,
-            candidates=request.candidates,
-            threshold=request.threshold,
-            max_results=request.max_results,
+        query_embedding = (
+            request.query_embedding
+            if request.query_embedding is not None
+            else decode_embedding_b64(request.query_embedding_b64)
+        )
+        matches, processing_ms = await anyio.to_thread.run_sync(
+            functools.partial(
+                match_embedding_against_candidates,
+                query_embedding=query_embedding,
+                candidates=request.candidates,
+                threshold=request.threshold,
+                max_results=request.max_results,
+                assume_normalized=settings.ASSUME_NORMALIZED_EMBEDDINGS,
+            )
         )
         return MatchResponse(
             success=True,
@@ -206,35 +255,148 @@ async def match_faces(request: MatchRequest):
 # ---------------------------------------------------------------
 
 @app.post("/batch-embed", response_model=BatchEmbedResponse, tags=["Face"], dependencies=[Depends(verify_api_key)])
-async def batch_embed_faces(request: BatchEmbedRequest):
+async def batch_embed_faces(request: BatchEmbedRequest, http_request: Request):
     """
     Process multiple images in a single request for the ingestion pipeline.
     Failed images are included in results with error field set.
+
+    With `Accept: application/x-ndjson`, streams one BatchEmbedResult per line
+    as each image completes instead of buffering the whole response.
+    """
+    items = [(item.image_id, item.image_base64) for item in request.images]
+    if _wants_ndjson(http_request):
+        return _stream_batch_embed(items, decode_base64_bytes)
+    return await anyio.to_thread.run_sync(_run_batch_embed, items, decode_base64_bytes)
+
+
+# ---------------------------------------------------------------
+# POST /embed-binary — multipart upload, no base64
+# ---------------------------------------------------------------
+
+@app.post("/embed-binary", response_model=EmbedResponse, tags=["Face"], dependencies=[Depends(verify_api_key)])
+async def embed_face_binary(
+    image: UploadFile = File(..., description="Raw JPEG/PNG/WEBP image"),
+    face_bbox: Optional[str] = Form(None, description="Optional FaceBoundingBox as JSON"),
+):
+    """
+    Same as /embed, but accepts the image as multipart/form-data.
+    Avoids the 33% base64 overhead and the base64 decode step.
+    """
+    try:
+        start = time.time()
+        bbox = FaceBoundingBox.model_validate_json(face_bbox) if face_bbox else None
+        embedding, face_confidence, face_quality = await _embed_payload(await image.read(), bbox)
+        processing_ms = int((time.time() - start) * 1000)
+        return EmbedResponse(
+            success=True,
+            embedding=embedding,
+            embedding_dims=len(embedding),
+            face_confidence=face_confidence,
+            face_quality=face_quality,
+            processing_ms=processing_ms,
+        )
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={"success": False, "error": str(exc)},
+        )
+    except Exception as exc:
+        logger.error({"msg": "Unexpected error in /embed-binary", "error": str(exc)})
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail={"success": False, "error": "Internal embedding error"},
+        )
+
+
+# ---------------------------------------------------------------
+# POST /batch-embed-binary — msgpack body, no base64
+# ---------------------------------------------------------------
+
+@app.post("/batch-embed-binary", response_model=BatchEmbedResponse, tags=["Face"], dependencies=[Depends(verify_api_key)])
+async def batch_embed_faces_binary(request: Request):
+    """
+    Same as /batch-embed (including NDJSON streaming), but the body is
+    application/msgpack: [{"image_id": str, "image_bytes": bin}, ...]
+    """
+    if request.headers.get("content-type", "").split(";")[0].strip() != "application/msgpack":
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail={"success": False, "error": "Expected application/msgpack body"},
+        )
+
+    try:
+        items = _parse_msgpack_batch(await request.body())
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={"success": False, "error": str(exc)},
+        )
+
+    if _wants_ndjson(request):
+        return _stream_batch_embed(items)
+    return await anyio.to_thread.run_sync(_run_batch_embed, items)
+
+
+def _parse_msgpack_batch(body: bytes) -> List[Tuple[str, bytes]]:
+    """Unpack and validate a msgpack batch body into (image_id, image_bytes) pairs."""
+    try:
+        payload: Any = msgpack.unpackb(body, raw=False)
+    except Exception as exc:
+        raise ValueError(f"Invalid msgpack body: {exc}") from exc
+
+    if not isinstance(payload, list):
+        raise ValueError("msgpack body must be a list of images")
+    if len(payload) > settings.MAX_BATCH_SIZE:
+        raise ValueError(f"Too many images: {len(payload)} (max {settings.MAX_BATCH_SIZE})")
+
+    items: List[Tuple[str, bytes]] = []
+    for entry in payload:
+        if (
+            not isinstance(entry, dict)
+            or not isinstance(entry.get("image_id"), str)
+            or not isinstance(entry.get("image_bytes"), bytes)
+        ):
+            raise ValueError("Each image must be {image_id: str, image_bytes: bin}")
+        items.append((entry["image_id"], entry["image_bytes"]))
+    return items
+
+
+def _wants_ndjson(request: Request) -> bool:
+    return "application/x-ndjson" in request.headers.get("accept", "")
+
+
+def _batch_result(image_id: str, outcome: Union[EmbeddingResult, Exception]) -> BatchEmbedResult:
+    """Turn one batch outcome (result tuple or exception) into a BatchEmbedResult."""
+    if isinstance(outcome, Exception):
+        logger.warning({"msg": "Batch embed failed for image", "image_id": image_id, "error": str(outcome)})
+        return BatchEmbedResult(
+            image_id=image_id,
+            success=False,
+            error=str(outcome),
+        )
+
+    embedding, face_confidence, face_quality = outcome
+    return BatchEmbedResult(
+        image_id=image_id,
+        success=True,
+        embedding=embedding,
+        face_confidence=face_confidence,
+        face_quality=face_quality,
+    )
+
+
+def _run_batch_embed(
+    items: List[Tuple[str, Any]],
+    to_bytes: Optional[Callable[[Any], bytes]] = None,
+) -> BatchEmbedResponse:
+    """
+    Embed (image_id, payload) pairs in one model forward pass.
+    Per-image failures are collected as error results.
     """
     start = time.time()
-    results: List[BatchEmbedResult] = []
-
-    for item in request.images:
-        try:
-            embedding, face_confidence, face_quality, _ = generate_embedding(item.image_base64)
-            results.append(
-                BatchEmbedResult(
-                    image_id=item.image_id,
-                    success=True,
-                    embedding=embedding,
-                    face_confidence=face_confidence,
-                    face_quality=face_quality,
-                )
-            )
-        except Exception as exc:
-            logger.warning({"msg": "Batch embed failed for image", "image_id": item.image_id, "error": str(exc)})
-            results.append(
-                BatchEmbedResult(
-                    image_id=item.image_id,
-                    success=False,
-                    error=str(exc),
-                )
-            )
+
+    outcomes = generate_embeddings_batch([payload for _, payload in items], to_bytes)
+    results = [_batch_result(image_id, outcome) for (image_id, _), outcome in zip(items, outcomes)]
 
     succeeded = sum(1 for r in results if r.success)
     failed = len(results) - succeeded
@@ -250,17 +412,55 @@ async def batch_embed_faces(request: BatchEmbedRequest):
     )
 
 
+def _stream_batch_embed(
+    items: List[Tuple[str, Any]],
+    to_bytes: Optional[Callable[[Any], bytes]] = None,
+) -> StreamingResponse:
+    """
+    NDJSON variant of _run_batch_embed: cache hits and failures are written as
+    soon as they are known, embedded images right after the single forward pass.
+    """
+    async def lines() -> AsyncIterator[bytes]:
+        outcomes = iter_embeddings_batch([payload for _, payload in items], to_bytes)
+        while True:
+            # Each step may preprocess an image or run the model — keep it off the loop
+            step = await anyio.to_thread.run_sync(next, outcomes, None)
+            if step is None:
+                break
+            index, outcome = step
+            yield orjson.dumps(_batch_result(items[index][0], outcome).model_dump()) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 # ---------------------------------------------------------------
-# App startup event
+# App lifecycle events
 # ---------------------------------------------------------------
 
 @app.on_event("startup")
 async def startup_event():
+    # Size the worker thread pool used for CPU-bound detect/embed/match work
+    thread_pool_size = settings.THREAD_POOL_SIZE or os.cpu_count() or 1
+    anyio.to_thread.current_default_thread_limiter().total_tokens = thread_pool_size
+    embed_batcher.start()
     logger.info(
         {
             "msg": "ReunIA Face Service starting",
             "model": settings.MODEL_NAME,
             "detector": settings.DETECTOR_BACKEND,
             "version": settings.VERSION,
+            "thread_pool_size": thread_pool_size,
         }
     )
+
+    # Load the recognition model once up front rather than on the first request
+    try:
+        backend = await anyio.to_thread.run_sync(load_embedding_model)
+        logger.info({"msg": "Recognition model loaded", "backend": backend})
+    except Exception as exc:
+        logger.error({"msg": "Failed to load recognition model", "error": str(exc)})
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await embed_batcher.stop()
@@ -2,10 +2,15 @@
 # ReunIA Face Service — Pydantic Schemas
 # =============================================================
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator, model_validator
 from typing import Optional, List
 from enum import Enum
 
+from config import settings
+
+# Base64 length of 512 packed little-endian float32 values (2048 bytes)
+EMBEDDING_B64_LENGTH = 4 * ((512 * 4 + 2) // 3)
+
 
 # ---------------------------------------------------------------
 # Enums
@@ -80,18 +85,62 @@ class MatchCandidate(BaseModel):
     confidence_tier: ConfidenceTier
 
 
+def _check_embedding_forms(embedding: Optional[List[float]], embedding_b64: Optional[str], name: str) -> None:
+    """Exactly one of the list / packed forms must be set; the list form is deprecated."""
+    if (embedding is None) == (embedding_b64 is None):
+        raise ValueError(f"Provide exactly one of {name} or {name}_b64")
+    if embedding is not None and not settings.ALLOW_FLOAT_LIST_EMBEDDINGS:
+        raise ValueError(f"{name} as a float list is disabled — send {name}_b64")
+
+
+def _check_embedding_b64(value: Optional[str]) -> Optional[str]:
+    """Single O(1) length check — the payload itself is decoded once in the matcher."""
+    if value is not None and len(value) != EMBEDDING_B64_LENGTH:
+        raise ValueError(
+            f"Packed embedding must be {EMBEDDING_B64_LENGTH} base64 chars (512 float32), got {len(value)}"
+        )
+    return value
+
+
 class MatchRequest(BaseModel):
-    query_embedding: List[float] = Field(..., min_length=512, max_length=512, description="512-dim query embedding")
+    query_embedding: Optional[List[float]] = Field(
+        None, min_length=512, max_length=512, description="512-dim query embedding (deprecated: use query_embedding_b64)"
+    )
+    query_embedding_b64: Optional[str] = Field(
+        None, description="Base64 of 512 little-endian float32 values"
+    )
     candidates: List["CandidateRecord"] = Field(..., description="Candidate embeddings to compare against")
     threshold: float = Field(0.55, ge=0.0, le=1.0, description="Minimum similarity to include in results")
     max_results: int = Field(20, ge=1, le=100, description="Maximum number of results to return")
 
+    _check_b64 = field_validator("query_embedding_b64")(_check_embedding_b64)
+
+    @model_validator(mode="after")
+    def _check_query_form(self) -> "MatchRequest":
+        _check_embedding_forms(self.query_embedding, self.query_embedding_b64, "query_embedding")
+        return self
+
 
 class CandidateRecord(BaseModel):
+    """
+    Candidate embedding for /match. Embeddings produced by this service are
+    L2-normalized; with ASSUME_NORMALIZED_EMBEDDINGS every candidate (and the
+    query) must be unit-norm, since similarity is then a plain dot product.
+    """
     face_embedding_id: str
     person_id: str
     case_id: str
-    embedding: List[float] = Field(..., min_length=512, max_length=512)
+    embedding: Optional[List[float]] = Field(
+        None, min_length=512, max_length=512, description="Deprecated: use embedding_b64"
+    )
+    embedding_b64: Optional[str] = Field(None, description="Base64 of 512 little-endian float32 values")
+
+    _check_b64 = field_validator("embedding_b64")(_check_embedding_b64)
+
+    @model_validator(mode="after")
+    def _check_form(self) -> "CandidateRecord":
+        _check_embedding_forms(self.embedding, self.embedding_b64, "embedding")
+        return self
 
 
 class MatchResponse(BaseModel):
@@ -1,4 +1,11 @@
-from .preprocessor import decode_base64_image, validate_image, normalize_image
+from .preprocessor import decode_base64_image, decode_base64_bytes, decode_image_bytes, validate_image, normalize_image
 from .detector import detect_faces_in_image
-from .embedder import generate_embedding, normalize_embedding
+from .embedder import (
+    generate_embedding,
+    generate_embedding_from_bytes,
+    generate_embeddings_batch,
+    load_embedding_model,
+    normalize_embedding,
+)
 from .matcher import match_embedding_against_candidates, get_confidence_tier, cosine_similarity
+from .batcher import EmbedBatcher, embed_batcher
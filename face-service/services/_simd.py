@@ -0,0 +1,60 @@
+# =============================================================
+# ReunIA Face Service — Native Kernels
+# Numba-compiled helpers for small hot paths (NumPy fallback)
+# =============================================================
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+if njit is not None:
+
+    @njit("f4(f4[::1], f4[::1])", cache=True, fastmath=True)
+    def dot512(a, b):
+        """
+        Dot product of two contiguous float32 vectors (512-dim embeddings).
+        Compiled to a vectorized FMA loop; callers must pass equal lengths.
+        """
+        total = np.float32(0.0)
+        for i in range(a.shape[0]):
+            total += a[i] * b[i]
+        return total
+
+    @njit("f8[::1](i8[:, ::1], i8)", cache=True)
+    def face_quality_batch(sizes, min_face_px):
+        """
+        estimate_face_quality over (N, 4) int64 rows of
+        [face_w, face_h, image_w, image_h], in the same integer basis points.
+        """
+        out = np.empty(sizes.shape[0], dtype=np.float64)
+        for i in range(sizes.shape[0]):
+            fw, fh, iw, ih = sizes[i, 0], sizes[i, 1], sizes[i, 2], sizes[i, 3]
+            image_area = iw * ih
+            min_dim = min(fw, fh)
+            if image_area == 0 or min_dim < min_face_px:
+                out[i] = 0.0
+                continue
+            area_bp = min(fw * fh * 10000 // image_area, 10000)
+            dim_bp = min(min_dim * 10000 // 112, 10000)
+            out[i] = ((4 * area_bp + 6 * dim_bp) // 10) / 10000
+        return out
+
+else:
+
+    def dot512(a, b):
+        """NumPy fallback when numba is not installed."""
+        return np.float32(np.dot(a, b))
+
+    def face_quality_batch(sizes, min_face_px):
+        """NumPy fallback when numba is not installed."""
+        fw, fh, iw, ih = sizes.T
+        image_area = iw * ih
+        min_dim = np.minimum(fw, fh)
+        area_bp = np.minimum(fw * fh * 10000 // np.maximum(image_area, 1), 10000)
+        dim_bp = np.minimum(min_dim * 10000 // 112, 10000)
+        quality = ((4 * area_bp + 6 * dim_bp) // 10) / 10000
+        return np.where((image_area == 0) | (min_dim < min_face_px), 0.0, quality)
@@ -0,0 +1,103 @@
+# =============================================================
+# ReunIA Face Service — Dynamic Embedding Batcher
+# Coalesces concurrent single-image /embed calls into one forward pass
+# =============================================================
+
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+
+import anyio
+import numpy as np
+
+from config import settings
+from services.embedder import embed_batch, stack_batch
+
+logger = logging.getLogger(__name__)
+
+
+class EmbedBatcher:
+    """
+    Micro-batching queue in front of embed_batch.
+
+    Each caller enqueues one preprocessed face tensor and awaits a future.
+    A background task drains up to max_batch_size tensors, waiting at most
+    max_wait_ms after the first one arrives, runs a single model forward in
+    a worker thread, and scatters the embeddings back to the futures.
+    """
+
+    def __init__(self, max_batch_size: int, max_wait_ms: int):
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the worker on the running event loop (no-op if already running there)."""
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._task.get_loop() is loop:
+            return
+        self._queue = asyncio.Queue()
+        self._task = loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Cancel the worker task."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def embed(self, tensor: np.ndarray) -> np.ndarray:
+        """Embed one (112, 112, 3) face tensor. Returns a (512,) float32 array."""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((tensor, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[Tuple[np.ndarray, asyncio.Future]] = [await self._queue.get()]
+            deadline = loop.time() + self._max_wait
+
+            while len(batch) < self._max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Callers that disconnected while waiting don't need a slot in the batch
+            batch = [(tensor, future) for tensor, future in batch if not future.done()]
+            if not batch:
+                continue
+
+            try:
+                # Only this task stacks on the loop thread, and it awaits the
+                # forward pass before reusing the scratch buffer
+                embeddings = await anyio.to_thread.run_sync(
+                    embed_batch, stack_batch([tensor for tensor, _ in batch])
+                )
+            except Exception as exc:
+                logger.warning({"msg": "Batched embed failed", "batch_size": len(batch), "error": str(exc)})
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+
+            logger.debug({"msg": "Batched embed", "batch_size": len(batch)})
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+
+
+embed_batcher = EmbedBatcher(
+    max_batch_size=settings.MAX_BATCH_SIZE,
+    max_wait_ms=settings.EMBED_BATCH_MAX_WAIT_MS,
+)
@@ -42,7 +42,7 @@ def detect_faces_in_image(
     try:
         from deepface import DeepFace
 
-        np_img = image_to_numpy(img)
+        np_img = image_to_numpy(img, reuse_buffer=True)
         face_objs = DeepFace.extract_faces(
             img_path=np_img,
             detector_backend=settings.DETECTOR_BACKEND,
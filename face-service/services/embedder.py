@@ -3,26 +3,62 @@
 # Produces 512-dimensional float32 embeddings via DeepFace
 # =============================================================
 
+import functools
 import logging
+import os
+import threading
 import time
-from typing import List, Optional, Tuple
+from typing import Any, Callable, Iterator, List, NamedTuple, Optional, Tuple, Union
 
+import cachetools
 import numpy as np
+import xxhash
 from PIL import Image
 
 from config import settings
 from models.schemas import FaceBoundingBox
 from services.preprocessor import (
-    decode_base64_image,
+    decode_and_prepare,
+    decode_base64_bytes,
+    decode_image_bytes,
+    is_complete_jpeg,
     validate_image,
     normalize_image,
     image_to_numpy,
-    crop_face,
     estimate_face_quality,
+    prepare_face_crop,
+    resize_to_model_input,
 )
 
 logger = logging.getLogger(__name__)
 
+EmbeddingResult = Tuple[List[float], Optional[float], Optional[float]]
+EmbeddingCacheKey = Tuple[int, Optional[Tuple[int, int, int, int]]]
+
+# Embeddings keyed by (xxh3 hash of raw image bytes, bbox) — repeated uploads
+# (retries, re-indexing, duplicate crawls) skip preprocessing and the model.
+# Stored as float32 arrays (2 KB each) rather than Python float lists.
+_embedding_cache: cachetools.LRUCache = cachetools.LRUCache(maxsize=max(1, settings.EMBED_CACHE_SIZE))
+_embedding_cache_lock = threading.Lock()
+_embedding_cache_stats = {"hits": 0, "misses": 0}
+
+# xxh3 of an encoded payload (e.g. base64 text) → xxh3 of its decoded bytes,
+# so resubmitted payloads find their cache entry before being decoded.
+# Full-payload digests, not head/tail samples: two photos sharing a header
+# must never share an embedding.
+_payload_digests: cachetools.LRUCache = cachetools.LRUCache(maxsize=max(1, settings.EMBED_CACHE_SIZE))
+
+# Per-thread (B, 112, 112, 3) input buffer that batches are stacked into,
+# instead of allocating a fresh ~150 KB-per-face tensor for every forward pass
+_scratch = threading.local()
+
+
+class PreparedFace(NamedTuple):
+    """A single face ready for the model, plus its detection metadata."""
+    tensor: np.ndarray  # (TARGET_SIZE, TARGET_SIZE, 3) float32 in [0, 1]
+    face_confidence: Optional[float]
+    face_quality: Optional[float]
+
 
 def generate_embedding(
     image_base64: str,
@@ -40,57 +76,360 @@ def generate_embedding(
         ValueError: If no face detected or image invalid.
     """
     start = time.time()
+    embedding, face_confidence, face_quality = embed_image_bytes(decode_base64_bytes(image_base64), face_bbox)
+    processing_ms = int((time.time() - start) * 1000)
+    return embedding, face_confidence, face_quality, processing_ms
 
-    # Decode & normalize
-    img = decode_base64_image(image_base64)
-    img = normalize_image(img)
-    width, height = validate_image(img)
 
-    # Crop if bbox provided
-    face_confidence: Optional[float] = None
-    face_quality: Optional[float] = None
+def generate_embedding_from_bytes(
+    raw_bytes: bytes,
+    face_bbox: Optional[FaceBoundingBox] = None,
+) -> Tuple[List[float], Optional[float], Optional[float], int]:
+    """
+    Same as generate_embedding, but takes raw JPEG/PNG/WEBP bytes
+    (multipart/msgpack endpoints) so no base64 decode is needed.
+    """
+    start = time.time()
+    embedding, face_confidence, face_quality = embed_image_bytes(raw_bytes, face_bbox)
+    processing_ms = int((time.time() - start) * 1000)
+    return embedding, face_confidence, face_quality, processing_ms
+
+
+def generate_embeddings_batch(
+    payloads: List[Any],
+    to_bytes: Optional[Callable[[Any], bytes]] = None,
+) -> List[Union[EmbeddingResult, Exception]]:
+    """
+    Embed several images with a single model forward pass.
+    Returns one entry per payload, in order: either
+    (embedding, face_confidence, face_quality) or the Exception that failed it.
+    See iter_embeddings_batch.
+    """
+    results: List[Union[EmbeddingResult, Exception, None]] = [None] * len(payloads)
+    for i, outcome in iter_embeddings_batch(payloads, to_bytes):
+        results[i] = outcome
+    return results
+
+
+def iter_embeddings_batch(
+    payloads: List[Any],
+    to_bytes: Optional[Callable[[Any], bytes]] = None,
+) -> Iterator[Tuple[int, Union[EmbeddingResult, Exception]]]:
+    """
+    Embed several images with a single model forward pass, yielding
+    (payload_index, outcome) as soon as each outcome is known.
+
+    Each payload is turned into raw image bytes with to_bytes (None: payloads
+    already are bytes), checked against the embedding cache, and preprocessed
+    individually — cache hits and failures are yielded immediately. All cache
+    misses are then stacked into one (B, 112, 112, 3) tensor and yielded after
+    the forward pass. Outcomes are (embedding, face_confidence, face_quality)
+    or the Exception that failed that payload.
+    """
+    prepared: List[Tuple[int, EmbeddingCacheKey, PreparedFace]] = []
+
+    for i, payload in enumerate(payloads):
+        try:
+            key, cached, face = lookup_or_preprocess(payload, None, to_bytes)
+        except Exception as exc:
+            yield i, exc
+            continue
+        if cached is not None:
+            yield i, cached
+        else:
+            prepared.append((i, key, face))
+
+    if not prepared:
+        return
+
+    try:
+        embeddings = embed_batch(stack_batch([face.tensor for _, _, face in prepared]))
+    except Exception as exc:
+        for i, _, _ in prepared:
+            yield i, exc
+        return
+
+    for (i, key, face), embedding in zip(prepared, embeddings):
+        yield i, cache_embedding(key, embedding, face)
+
+
+def embed_image_bytes(
+    raw_bytes: bytes,
+    face_bbox: Optional[FaceBoundingBox] = None,
+) -> EmbeddingResult:
+    """
+    Shared single-image embedding path for raw image bytes (cache-aware).
+    Returns (embedding, face_confidence, face_quality).
+    """
+    key, cached, face = lookup_or_preprocess(raw_bytes, face_bbox)
+    if cached is not None:
+        return cached
+    return cache_embedding(key, embed_batch(face.tensor[None])[0], face)
+
+
+def lookup_or_preprocess(
+    payload: Any,
+    face_bbox: Optional[FaceBoundingBox] = None,
+    to_bytes: Optional[Callable[[Any], bytes]] = None,
+) -> Tuple[EmbeddingCacheKey, Optional[EmbeddingResult], Optional[PreparedFace]]:
+    """
+    Check the embedding cache for this image + bbox.
+    `payload` is raw image bytes, or is turned into them with to_bytes (e.g.
+    base64 text); encoded payloads are also remembered by their own digest,
+    so a resubmitted payload hits the cache without being decoded at all.
+    Returns (key, cached_result, None) on a hit, or (key, None, prepared_face)
+    on a miss — pass the model output for prepared_face to cache_embedding.
+    """
+    bbox_key = (face_bbox.x, face_bbox.y, face_bbox.w, face_bbox.h) if face_bbox is not None else None
+    payload_digest: Optional[int] = None
+
+    if to_bytes is not None and settings.EMBED_CACHE_SIZE > 0:
+        payload_digest = xxhash.xxh3_64_intdigest(payload)
+        with _embedding_cache_lock:
+            raw_digest = _payload_digests.get(payload_digest)
+        if raw_digest is not None:
+            key: EmbeddingCacheKey = (raw_digest, bbox_key)
+            cached = _get_cached_embedding(key)
+            if cached is not None:
+                return key, cached, None
+            return key, None, prepare_face_bytes(to_bytes(payload), face_bbox)
+
+    raw_bytes = to_bytes(payload) if to_bytes is not None else payload
+    key = (xxhash.xxh3_64_intdigest(raw_bytes), bbox_key)
+    if payload_digest is not None:
+        with _embedding_cache_lock:
+            _payload_digests[payload_digest] = key[0]
+
+    cached = _get_cached_embedding(key)
+    if cached is not None:
+        return key, cached, None
+    return key, None, prepare_face_bytes(raw_bytes, face_bbox)
+
+
+def _get_cached_embedding(key: EmbeddingCacheKey) -> Optional[EmbeddingResult]:
+    """Embedding cache lookup (None on a miss or when the cache is disabled)."""
+    if settings.EMBED_CACHE_SIZE <= 0:
+        return None
+
+    with _embedding_cache_lock:
+        entry = _embedding_cache.get(key)
+        _embedding_cache_stats["hits" if entry is not None else "misses"] += 1
+    if entry is None:
+        return None
+
+    embedding, face_confidence, face_quality = entry
+    logger.debug({"msg": "Embedding cache hit", **_embedding_cache_stats})
+    return embedding.tolist(), face_confidence, face_quality
+
+
+def cache_embedding(
+    key: EmbeddingCacheKey,
+    embedding: np.ndarray,
+    face: PreparedFace,
+) -> EmbeddingResult:
+    """Store a freshly computed embedding under key. Returns the EmbeddingResult."""
+    if settings.EMBED_CACHE_SIZE > 0:
+        with _embedding_cache_lock:
+            _embedding_cache[key] = (embedding.copy(), face.face_confidence, face.face_quality)
+    return embedding.tolist(), face.face_confidence, face.face_quality
+
+
+def prepare_face_bytes(
+    raw_bytes: bytes,
+    face_bbox: Optional[FaceBoundingBox] = None,
+) -> PreparedFace:
+    """
+    Preprocess raw image bytes into the model input tensor.
+    Bbox requests on complete JPEGs take the OpenCV decode path; everything
+    else (including JPEGs whose frame header can't be parsed) is opened with
+    PIL and goes through preprocess_face.
+    Raises ValueError if no face is detected or the image is invalid.
+    """
+    prepared = None
+    if face_bbox is not None and is_complete_jpeg(raw_bytes):
+        prepared = decode_and_prepare(
+            raw_bytes, face_bbox.x, face_bbox.y, face_bbox.w, face_bbox.h, settings.TARGET_SIZE
+        )
+    if prepared is None:
+        return preprocess_face(decode_image_bytes(raw_bytes), face_bbox)
+
+    tensor, (width, height) = prepared
+    face_quality = estimate_face_quality(face_bbox.w, face_bbox.h, width, height)
+    return PreparedFace(tensor=tensor, face_confidence=None, face_quality=face_quality)
+
+
+def preprocess_face(
+    img: Image.Image,
+    face_bbox: Optional[FaceBoundingBox] = None,
+) -> PreparedFace:
+    """
+    Normalize, validate, locate and resize a face into the model input tensor.
 
+    Mirrors DeepFace.represent preprocessing so embeddings stay comparable with
+    ones already stored: with a bbox the crop is used as-is ("skip" backend),
+    otherwise the detector backend finds and aligns the most prominent face.
+    Raises ValueError if no face is detected or the image is invalid.
+    """
     if face_bbox is not None:
-        img = crop_face(img, face_bbox.x, face_bbox.y, face_bbox.w, face_bbox.h)
+        width, height = validate_image(img)
         face_quality = estimate_face_quality(face_bbox.w, face_bbox.h, width, height)
+        # DeepFace's "skip" backend feeds the loaded BGR array through its
+        # RGB→BGR flip, so the model sees RGB channel order here
+        tensor = prepare_face_crop(
+            img, face_bbox.x, face_bbox.y, face_bbox.w, face_bbox.h, settings.TARGET_SIZE
+        )
+        return PreparedFace(tensor=tensor, face_confidence=None, face_quality=face_quality)
+
+    # Normalize & validate
+    img = normalize_image(img)
+    width, height = validate_image(img)
 
     # Convert to numpy for DeepFace
-    np_img = image_to_numpy(img)
+    np_img = image_to_numpy(img, reuse_buffer=True)
 
     try:
         from deepface import DeepFace
 
-        result = DeepFace.represent(
+        face_objs = DeepFace.extract_faces(
             img_path=np_img,
-            model_name=settings.MODEL_NAME,
-            detector_backend=settings.DETECTOR_BACKEND if face_bbox is None else "skip",
+            detector_backend=settings.DETECTOR_BACKEND,
             align=True,
-            enforce_detection=face_bbox is None,  # Only enforce detection if no bbox given
+            enforce_detection=True,
         )
     except Exception as exc:
         raise ValueError(f"Failed to generate embedding: {exc}") from exc
 
-    if not result or len(result) == 0:
+    if not face_objs:
         raise ValueError("No face detected in image — cannot generate embedding")
 
-    # Use the first (most prominent) face result
-    embedding_obj = result[0]
-    embedding: List[float] = embedding_obj.get("embedding", [])
-
-    if len(embedding) != 512:
-        raise ValueError(f"Unexpected embedding dimension: {len(embedding)} (expected 512)")
+    # Use the first (most prominent) face; DeepFace returns it as RGB in [0, 1]
+    face_obj = face_objs[0]
+    tensor = resize_to_model_input(face_obj["face"][:, :, ::-1], settings.TARGET_SIZE)
 
     # Extract face confidence and quality if available
-    if face_bbox is None:
-        facial_area = embedding_obj.get("facial_area", {})
-        fw = facial_area.get("w", 0)
-        fh = facial_area.get("h", 0)
-        if fw > 0 and fh > 0:
-            face_quality = estimate_face_quality(fw, fh, width, height)
-        face_confidence = embedding_obj.get("face_confidence")
+    face_quality: Optional[float] = None
+    facial_area = face_obj.get("facial_area", {})
+    fw = facial_area.get("w", 0)
+    fh = facial_area.get("h", 0)
+    if fw > 0 and fh > 0:
+        face_quality = estimate_face_quality(fw, fh, width, height)
 
-    processing_ms = int((time.time() - start) * 1000)
-    return embedding, face_confidence, face_quality, processing_ms
+    return PreparedFace(tensor=tensor, face_confidence=face_obj.get("confidence"), face_quality=face_quality)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_model() -> Any:
+    """Build (once) the DeepFace recognition model configured in settings."""
+    from deepface import DeepFace
+
+    return DeepFace.build_model(settings.MODEL_NAME)
+
+
+def export_onnx_model(path: str) -> None:
+    """
+    Export the DeepFace Keras recognition model to ONNX at `path`.
+    Requires tf2onnx, which is not a runtime dependency.
+    """
+    # Build the model first: importing DeepFace selects legacy tf_keras
+    # (TF_USE_LEGACY_KERAS), which only takes effect before TensorFlow loads
+    keras_model = _get_model().model
+
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = (tf.TensorSpec((None, settings.TARGET_SIZE, settings.TARGET_SIZE, 3), tf.float32, name="input"),)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tf2onnx.convert.from_keras(keras_model, input_signature=spec, output_path=path)
+    logger.info({"msg": "Exported recognition model to ONNX", "path": path})
+
+
+@functools.lru_cache(maxsize=1)
+def _get_onnx_session() -> Optional[Any]:
+    """
+    Open (once) a persistent ONNX Runtime session for the recognition model.
+    Exports the model first if the file is missing. Returns None — and
+    embed_batch falls back to the DeepFace Keras model — if ONNX_MODEL_PATH
+    is empty or the session cannot be created.
+    """
+    if not settings.ONNX_MODEL_PATH:
+        return None
+
+    path = os.path.expanduser(settings.ONNX_MODEL_PATH)
+    try:
+        if not os.path.exists(path):
+            export_onnx_model(path)
+
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = os.cpu_count() or 1
+        return ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+    except Exception as exc:
+        logger.warning({"msg": "ONNX model unavailable, using DeepFace model", "path": path, "error": str(exc)})
+        return None
+
+
+def load_embedding_model() -> str:
+    """Eagerly load the recognition model (called at startup). Returns the backend used."""
+    if _get_onnx_session() is not None:
+        return "onnxruntime"
+    _get_model()
+    return "deepface"
+
+
+def scratch_batch(batch_size: int) -> np.ndarray:
+    """
+    Return a (batch_size, TARGET_SIZE, TARGET_SIZE, 3) float32 view of this
+    thread's reusable input buffer, growing it when a larger batch arrives.
+    The contents are only valid until the thread's next call.
+    """
+    buffer = getattr(_scratch, "batch", None)
+    if buffer is None or buffer.shape[0] < batch_size:
+        size = settings.TARGET_SIZE
+        buffer = np.empty((max(batch_size, 1), size, size, 3), dtype=np.float32)
+        _scratch.batch = buffer
+    return buffer[:batch_size]
+
+
+def stack_batch(tensors: List[np.ndarray]) -> np.ndarray:
+    """
+    Stack face tensors into this thread's scratch buffer (see scratch_batch).
+    The result must be consumed — e.g. by embed_batch, whose outputs never
+    alias its input — before the thread stacks another batch.
+    """
+    return np.stack(tensors, out=scratch_batch(len(tensors)))
+
+
+def embed_batch(batch: np.ndarray) -> np.ndarray:
+    """
+    Run the recognition model on a (B, 112, 112, 3) float32 batch in one
+    forward pass, via ONNX Runtime when available, otherwise the DeepFace
+    Keras model — bypassing DeepFace's per-image represent() wrapper.
+    Returns a (B, 512) float32 array of L2-normalized rows, so cosine
+    similarity against other service embeddings is a plain dot product.
+    Raises ValueError if the model fails or returns an unexpected shape.
+    """
+    try:
+        session = _get_onnx_session()
+        if session is not None:
+            input_name = session.get_inputs()[0].name
+            embeddings = session.run(None, {input_name: batch.astype(np.float32, copy=False)})[0]
+        else:
+            embeddings = _get_model().model(batch, training=False)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+    except Exception as exc:
+        raise ValueError(f"Failed to generate embedding: {exc}") from exc
+
+    if embeddings.shape != (batch.shape[0], 512):
+        raise ValueError(f"Unexpected embedding shape: {embeddings.shape} (expected ({batch.shape[0]}, 512))")
+
+    # L2-normalize at the source, once per embedding
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    embeddings = embeddings / norms
+
+    return embeddings
 
 
 def normalize_embedding(embedding: List[float]) -> List[float]:
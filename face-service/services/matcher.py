@@ -3,39 +3,128 @@
 # Cosine similarity + threshold-based confidence tiers
 # =============================================================
 
+import base64
+import hashlib
 import logging
+import math
+import threading
 import time
-from typing import List
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple, Union
 
 import numpy as np
 
 from config import settings
 from models.schemas import MatchCandidate, CandidateRecord, ConfidenceTier
+from services._simd import dot512
+
+# pybase64 uses a SIMD (AVX2/AVX-512) decoder — fall back to stdlib if not installed
+try:
+    import pybase64 as _base64
+except ImportError:
+    _base64 = base64
+
+# Direct BLAS sgemv skips NumPy's matmul dispatch — optional
+try:
+    from scipy.linalg import blas as _blas
+except ImportError:
+    _blas = None
 
 logger = logging.getLogger(__name__)
 
 
-def cosine_similarity(a: List[float], b: List[float]) -> float:
+class PreparedCandidates(NamedTuple):
+    """
+    Row-normalized candidate matrix plus the ids of each row, in order.
+    When `scales` is set the matrix is int8-quantized (see quantize_matrix).
+    """
+    matrix: np.ndarray          # (N, 512) C-contiguous float32 unit-norm rows, or int8
+    scales: Optional[np.ndarray]  # (N,) float32 per-row scales for int8 matrices
+    face_embedding_ids: Tuple[str, ...]
+    person_ids: Tuple[str, ...]
+    case_ids: Tuple[str, ...]
+
+
+# LRU of prepared matrices keyed by (ordered ids, payload hash)
+_matrix_cache: "OrderedDict[tuple, PreparedCandidates]" = OrderedDict()
+_matrix_cache_lock = threading.Lock()
+
+
+def cosine_similarity(
+    a: Union[List[float], np.ndarray],
+    b: Union[List[float], np.ndarray],
+    assume_normalized: bool = False,
+) -> float:
     """
     Compute cosine similarity between two embedding vectors.
-    Assumes vectors are already L2-normalized (dot product = cosine similarity).
+    With assume_normalized, vectors must already be L2-normalized and the
+    similarity is a plain dot product (no norm computation).
+    Contiguous float32 arrays are used as-is; dot products run in dot512.
     Returns value in [-1.0, 1.0]. Clamp to [0, 1] for face match context.
     """
-    arr_a = np.array(a, dtype=np.float32)
-    arr_b = np.array(b, dtype=np.float32)
+    arr_a = np.ascontiguousarray(a, dtype=np.float32)
+    arr_b = np.ascontiguousarray(b, dtype=np.float32)
+
+    if arr_a.shape != arr_b.shape or arr_a.ndim != 1:
+        raise ValueError(f"Embedding shapes differ: {arr_a.shape} vs {arr_b.shape}")
+
+    dot = float(dot512(arr_a, arr_b))
+
+    if assume_normalized:
+        similarity = dot
+    else:
+        # Normalize both vectors
+        norm_sq_a = float(dot512(arr_a, arr_a))
+        norm_sq_b = float(dot512(arr_b, arr_b))
 
-    # Normalize both vectors
-    norm_a = np.linalg.norm(arr_a)
-    norm_b = np.linalg.norm(arr_b)
+        if norm_sq_a == 0 or norm_sq_b == 0:
+            return 0.0
 
-    if norm_a == 0 or norm_b == 0:
-        return 0.0
+        similarity = dot / math.sqrt(norm_sq_a * norm_sq_b)
 
-    similarity = float(np.dot(arr_a / norm_a, arr_b / norm_b))
     # Clamp to [0, 1] — negative similarity is meaningless for face matching
     return max(0.0, min(1.0, similarity))
 
 
+def quantize_embedding(embedding: List[float], assume_normalized: bool = False) -> Tuple[np.ndarray, float]:
+    """
+    L2-normalize an embedding (unless assume_normalized) and quantize it to
+    int8 with a per-vector scale.
+    Returns (int8[512], scale) where embedding ≈ q * scale / 127.
+    """
+    arr = np.asarray(embedding, dtype=np.float32)
+    if not assume_normalized:
+        arr = arr / (np.linalg.norm(arr) or 1.0)
+    scale = float(np.max(np.abs(arr))) or 1.0
+    quantized = np.rint(arr * (127.0 / scale)).astype(np.int8)
+    return quantized, scale
+
+
+def quantize_matrix(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Row-wise int8 quantization of an already L2-normalized (N, 512) matrix.
+    Returns (int8[N, 512], float32[N] scales), same convention as quantize_embedding.
+    """
+    scales = np.max(np.abs(matrix), axis=1)
+    scales[scales == 0] = 1.0
+    quantized = np.rint(matrix * (127.0 / scales)[:, None]).astype(np.int8)
+    return np.ascontiguousarray(quantized), scales.astype(np.float32)
+
+
+def int8_similarities(
+    matrix: np.ndarray,
+    scales: np.ndarray,
+    query: np.ndarray,
+    query_scale: float,
+) -> np.ndarray:
+    """
+    Cosine similarities from int8-quantized rows and query.
+    Integer dot products are accumulated in int32, then rescaled to float32.
+    """
+    dots = matrix.astype(np.int32) @ query.astype(np.int32)
+    return dots.astype(np.float32) * (scales * np.float32(query_scale / (127 * 127)))
+
+
 def get_confidence_tier(similarity: float) -> ConfidenceTier:
     """
     Map cosine similarity score to a confidence tier.
@@ -56,11 +145,99 @@ def get_confidence_tier(similarity: float) -> ConfidenceTier:
         return ConfidenceTier.REJECTED
 
 
+def decode_embedding_b64(embedding_b64: str) -> np.ndarray:
+    """
+    Decode a base64-packed little-endian float32 embedding to a (512,) array.
+    Raises ValueError on invalid base64 or wrong size.
+    """
+    raw = _base64.b64decode(embedding_b64, validate=True)
+    if len(raw) != 512 * 4:
+        raise ValueError(f"Packed embedding must be {512 * 4} bytes, got {len(raw)}")
+    return np.frombuffer(raw, dtype="<f4").astype(np.float32)
+
+
+def _stack_candidate_embeddings(candidates: List[CandidateRecord]) -> np.ndarray:
+    """
+    Build a writable C-contiguous (N, 512) float32 matrix from candidates.
+    Packed (embedding_b64) candidates are decoded into one contiguous buffer
+    with no per-float Python work; the deprecated list form is still accepted.
+    """
+    if all(c.embedding_b64 is not None for c in candidates):
+        try:
+            buf = b"".join(_base64.b64decode(c.embedding_b64, validate=True) for c in candidates)
+        except Exception as exc:
+            raise ValueError(f"Invalid packed candidate embedding: {exc}") from exc
+        if len(buf) != len(candidates) * 512 * 4:
+            raise ValueError("Packed candidate embeddings must be 512 float32 values each")
+        return np.frombuffer(buf, dtype="<f4").reshape(-1, 512).astype(np.float32)
+
+    matrix = np.empty((len(candidates), 512), dtype=np.float32)
+    for i, c in enumerate(candidates):
+        matrix[i] = c.embedding if c.embedding_b64 is None else decode_embedding_b64(c.embedding_b64)
+    return matrix
+
+
+def prepare_candidate_matrix(
+    candidates: List[CandidateRecord],
+    assume_normalized: bool = False,
+) -> PreparedCandidates:
+    """
+    Stack candidate embeddings into a row-normalized (N, 512) float32 matrix,
+    quantized to int8 only when QUANTIZE_MIN_CANDIDATES is set and exceeded.
+
+    Results are cached by the ordered candidate id tuples plus a blake2b
+    hash of the embedding bytes, so repeated queries against the same candidate
+    set (pagination, re-ranking) skip normalization entirely. The hash keeps a
+    cache hit correct if an id is re-embedded with different values.
+    """
+    raw = _stack_candidate_embeddings(candidates)
+    ids = tuple(c.face_embedding_id for c in candidates)
+    person_ids = tuple(c.person_id for c in candidates)
+    case_ids = tuple(c.case_id for c in candidates)
+    payload_hash = hashlib.blake2b(raw.data, digest_size=8).digest()
+    key = (ids, person_ids, case_ids, payload_hash, assume_normalized)
+
+    with _matrix_cache_lock:
+        prepared = _matrix_cache.get(key)
+        if prepared is not None:
+            _matrix_cache.move_to_end(key)
+            return prepared
+
+    # L2-normalize rows in place (skipped when candidates are already unit-norm)
+    if not assume_normalized:
+        norms = np.linalg.norm(raw, axis=1)
+        norms[norms == 0] = 1.0
+        raw /= norms[:, None]
+
+    # Opt-in int8 storage: a quarter of the cache memory, at a per-query cost
+    scales = None
+    if 0 < settings.QUANTIZE_MIN_CANDIDATES < len(candidates):
+        raw, scales = quantize_matrix(raw)
+    raw.setflags(write=False)  # Shared across requests — must never be mutated
+
+    prepared = PreparedCandidates(
+        matrix=raw,
+        scales=scales,
+        face_embedding_ids=ids,
+        person_ids=person_ids,
+        case_ids=case_ids,
+    )
+
+    with _matrix_cache_lock:
+        _matrix_cache[key] = prepared
+        _matrix_cache.move_to_end(key)
+        while len(_matrix_cache) > settings.MATCH_CACHE_SIZE:
+            _matrix_cache.popitem(last=False)
+
+    return prepared
+
+
 def match_embedding_against_candidates(
-    query_embedding: List[float],
+    query_embedding: Union[List[float], np.ndarray],
     candidates: List[CandidateRecord],
     threshold: float = 0.55,
     max_results: int = 20,
+    assume_normalized: bool = False,
 ) -> tuple[List[MatchCandidate], int]:
     """
     Compare a query embedding against a list of candidate embeddings.
@@ -68,6 +245,8 @@ def match_embedding_against_candidates(
 
     Matches are sorted by similarity score descending (best matches first).
     Only candidates with similarity >= threshold are included.
+    With assume_normalized, all embeddings must be unit-norm (as produced by
+    embed_batch) and similarity is a pure dot product with no norm pre-pass.
     """
     start = time.time()
 
@@ -77,38 +256,45 @@ def match_embedding_against_candidates(
     if len(query_embedding) != 512:
         raise ValueError(f"Query embedding must be 512-dim, got {len(query_embedding)}")
 
-    results: List[MatchCandidate] = []
+    prepared = prepare_candidate_matrix(candidates, assume_normalized)
 
-    for candidate in candidates:
-        if len(candidate.embedding) != 512:
-            logger.warning(
-                {"msg": "Skipping candidate with wrong embedding dim", "id": candidate.face_embedding_id}
-            )
-            continue
+    # Single GEMV: (N,) similarities, clamped to [0, 1]
+    if prepared.scales is not None:
+        q_i8, q_scale = quantize_embedding(query_embedding, assume_normalized)
+        sims = int8_similarities(prepared.matrix, prepared.scales, q_i8, q_scale)
+    else:
+        query = np.array(query_embedding, dtype=np.float32)
+        if not assume_normalized:
+            query /= (np.linalg.norm(query) or 1.0)
+        sims = prepared.matrix @ query
+    sims = np.clip(sims, 0.0, 1.0)
 
-        similarity = cosine_similarity(query_embedding, candidate.embedding)
-        tier = get_confidence_tier(similarity)
+    # Skip REJECTED entries and anything below the requested threshold
+    cutoff = max(threshold, settings.THRESHOLD_LOW)
+    idx = np.where(sims >= cutoff)[0]
 
-        # Skip REJECTED entries (below threshold)
-        if tier == ConfidenceTier.REJECTED or similarity < threshold:
-            continue
+    # Isolate the top max_results in O(N) before sorting, so only ≤ max_results
+    # survivors are sorted and turned into response models
+    if len(idx) > max_results:
+        idx = idx[np.argpartition(-sims[idx], max_results - 1)[:max_results]]
 
+    # Sort by similarity descending — best matches first
+    idx = idx[np.argsort(-sims[idx], kind="stable")]
+
+    # Only build response models for the surviving candidates
+    results: List[MatchCandidate] = []
+    for i in idx:
+        similarity = float(sims[i])
         results.append(
             MatchCandidate(
-                face_embedding_id=candidate.face_embedding_id,
-                person_id=candidate.person_id,
-                case_id=candidate.case_id,
+                face_embedding_id=prepared.face_embedding_ids[i],
+                person_id=prepared.person_ids[i],
+                case_id=prepared.case_ids[i],
                 similarity=round(similarity, 6),
-                confidence_tier=tier,
+                confidence_tier=get_confidence_tier(similarity),
             )
         )
 
-    # Sort by similarity descending — best matches first
-    results.sort(key=lambda m: m.similarity, reverse=True)
-
-    # Limit results
-    results = results[:max_results]
-
     processing_ms = int((time.time() - start) * 1000)
     return results, processing_ms
 
@@ -116,37 +302,45 @@ def match_embedding_against_candidates(
 def batch_compute_similarities(
     query_embedding: List[float],
     candidate_embeddings: List[List[float]],
+    assume_normalized: bool = False,
 ) -> List[float]:
     """
     Vectorized cosine similarity computation for a query against multiple candidates.
     Faster than individual comparisons for large batches.
+    With assume_normalized, both norm computations are skipped.
     """
     if not candidate_embeddings:
         return []
 
-    query_arr = np.array(query_embedding, dtype=np.float32)
-    query_norm = np.linalg.norm(query_arr)
+    query_normalized = np.asarray(query_embedding, dtype=np.float32)
 
-    if query_norm == 0:
-        return [0.0] * len(candidate_embeddings)
+    # Stack all candidates into a fresh (N, 512) matrix — the only copy made
+    candidates_matrix = np.array(candidate_embeddings, dtype=np.float32, order="C")
 
-    query_normalized = query_arr / query_norm
+    if not assume_normalized:
+        query_norm = np.linalg.norm(query_normalized)
 
-    # Stack all candidates into matrix: (N, 512)
-    candidates_matrix = np.array(candidate_embeddings, dtype=np.float32)
+        if query_norm == 0:
+            return [0.0] * len(candidate_embeddings)
 
-    # Compute norms for each candidate row
-    candidate_norms = np.linalg.norm(candidates_matrix, axis=1, keepdims=True)
-    # Avoid division by zero
-    candidate_norms = np.where(candidate_norms == 0, 1.0, candidate_norms)
+        query_normalized = query_normalized / query_norm
 
-    # Normalize rows
-    candidates_normalized = candidates_matrix / candidate_norms
+        # Compute norms for each candidate row
+        candidate_norms = np.linalg.norm(candidates_matrix, axis=1, keepdims=True)
+        # Avoid division by zero
+        candidate_norms[candidate_norms == 0] = 1.0
+
+        # Normalize rows in place
+        candidates_matrix /= candidate_norms
 
     # Batch dot product: (N,) similarities
-    similarities = np.dot(candidates_normalized, query_normalized)
+    if _blas is not None:
+        # The transposed C-order matrix is Fortran-order, so sgemv needs no copy
+        similarities = _blas.sgemv(1.0, candidates_matrix.T, query_normalized, trans=1)
+    else:
+        similarities = np.dot(candidates_matrix, query_normalized)
 
     # Clamp to [0, 1]
-    similarities = np.clip(similarities, 0.0, 1.0)
+    np.clip(similarities, 0.0, 1.0, out=similarities)
 
     return similarities.tolist()
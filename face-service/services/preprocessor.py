@@ -3,55 +3,271 @@
 # =============================================================
 
 import base64
+import binascii
+import functools
 import io
 import logging
-from typing import Optional, Tuple
-
+import math
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple, Union
+
+import cv2
 import numpy as np
-from PIL import Image, ImageOps
+from PIL import Image, ImageOps, UnidentifiedImageError
 
 from config import settings
+from services._simd import face_quality_batch
+
+# pybase64 uses a SIMD (AVX2/AVX-512) decoder — fall back to stdlib if not installed
+try:
+    import pybase64 as _base64
+except ImportError:
+    _base64 = base64
+
+# libjpeg-turbo's TurboJPEG API can losslessly crop a JPEG to the MCU blocks
+# around a face before decoding, so only the ROI is ever IDCT'd. Needs the
+# system libturbojpeg as well — fall back to full decodes without either
+try:
+    from turbojpeg import TJPF_RGB, TurboJPEG, tjMCUHeight, tjMCUWidth
+
+    _turbojpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    _turbojpeg = None
 
 logger = logging.getLogger(__name__)
 
 ALLOWED_MIME_TYPES = {"image/jpeg", "image/png", "image/webp", "image/jpg"}
 MIN_DIMENSION_PX = 48
+EXIF_ORIENTATION_TAG = 0x0112
+# PIL reports multi-picture camera JPEGs (MPO) as their own format
+ALLOWED_IMAGE_FORMATS = {"JPEG", "MPO", "PNG", "WEBP"}
+# image_to_numpy(reuse_buffer=True) keeps one BGR output buffer per thread,
+# up to this many pixels, so same-sized uploads skip a large allocation
+BGR_SCRATCH_MAX_PIXELS = 4_000_000
+_bgr_scratch = threading.local()
+
+JPEG_REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# "data:image/jpeg;base64," and friends always end within this many chars
+DATA_URI_PREFIX_MAX_CHARS = 64
+
+# MIME encoders wrap base64 at 76 (or 64/60) columns with CRLF or LF
+B64_LINE_MAX_CHARS = 76
+_B64_WHITESPACE = b" \t\r\n\v\f"
+
+# Header sniffing: 48 bytes covers PNG/WEBP headers and simple JPEGs;
+# JPEGs with large EXIF/ICC segments need a longer prefix
+HEADER_PEEK_BYTES = 48
+JPEG_HEADER_PEEK_BYTES = 48 * 1024
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def decode_base64_image(image_base64: Union[str, bytes]) -> Image.Image:
+    """
+    Decode a base64 string (or ASCII bytes) to a PIL Image.
+    Handles optional data URI prefix (data:image/jpeg;base64,...).
+    Raises ValueError on invalid input.
+    """
+    return decode_image_bytes(decode_base64_bytes(image_base64))
 
 
-def decode_base64_image(image_base64: str) -> Image.Image:
+def decode_base64_bytes(image_base64: Union[str, bytes]) -> bytes:
     """
-    Decode a base64 string to a PIL Image.
+    Decode a base64 image payload to raw bytes, without opening the image.
+    Accepts str or any bytes-like object; bytes are only ever sliced through
+    a memoryview, so the encoded body is never copied before decoding.
     Handles optional data URI prefix (data:image/jpeg;base64,...).
     Raises ValueError on invalid input.
     """
     try:
-        # Strip data URI prefix if present
-        if "," in image_base64:
-            image_base64 = image_base64.split(",", 1)[1]
+        # Strip data URI prefix if present — it's short, so only the head is scanned
+        if isinstance(image_base64, str):
+            comma = image_base64.find(",", 0, DATA_URI_PREFIX_MAX_CHARS)
+            tail = image_base64[-4:].encode("ascii")
+        else:
+            image_base64 = memoryview(image_base64).cast("B")
+            comma = image_base64[:DATA_URI_PREFIX_MAX_CHARS].tobytes().find(b",")
+            tail = image_base64[-4:].tobytes()
+        if comma >= 0:
+            image_base64 = image_base64[comma + 1:]
+    except Exception as exc:
+        raise ValueError(f"Invalid base64 encoding: {exc}") from exc
+
+    # Reject oversized payloads before decoding anything: 4 chars → 3 bytes,
+    # less trailing padding, is the exact decoded size of a well-formed
+    # payload. Line breaks in MIME-wrapped payloads aren't data, so they are
+    # counted out first (wrapped payloads always break within the first line)
+    tail = tail.rstrip(_B64_WHITESPACE)
+    padding = len(tail) - len(tail.rstrip(b"="))
+    data_chars = len(image_base64)
+    if _b64_whitespace_count(image_base64[:B64_LINE_MAX_CHARS + 2]):
+        data_chars -= _b64_whitespace_count(image_base64)
+    decoded_size = (data_chars * 3 >> 2) - padding
+    if decoded_size > settings.MAX_IMAGE_SIZE_BYTES:
+        raise ValueError(
+            f"Image too large: {decoded_size} bytes "
+            f"(max {settings.MAX_IMAGE_SIZE_BYTES} bytes)"
+        )
 
-        # Add padding if missing
-        padding = 4 - len(image_base64) % 4
-        if padding != 4:
-            image_base64 += "=" * padding
+    # Peek at the header so unsupported formats and pixel bombs never get fully
+    # decoded. A peek cut mid-quantum (line-wrapped payloads) only leaves the
+    # header unknown — the full decode below still validates the payload
+    peek_chars = HEADER_PEEK_BYTES * 4 // 3
+    try:
+        head = _b64decode(image_base64[:peek_chars])
+        if head[:2] == b"\xff\xd8" and len(image_base64) > peek_chars:
+            head = _b64decode(image_base64[:JPEG_HEADER_PEEK_BYTES * 4 // 3])
+    except (ValueError, TypeError):
+        head = None
+    if head is not None:
+        check_image_header(head)
 
-        raw_bytes = base64.b64decode(image_base64)
-    except Exception as exc:
+    try:
+        raw_bytes = _b64decode(image_base64)
+    except (binascii.Error, TypeError) as exc:
         raise ValueError(f"Invalid base64 encoding: {exc}") from exc
 
+    return raw_bytes
+
+
+def _b64_whitespace_count(data: Union[str, memoryview]) -> int:
+    """Count the whitespace (line break) characters in a base64 payload."""
+    if isinstance(data, str):
+        return sum(data.count(chr(c)) for c in _B64_WHITESPACE)
+    raw = data.tobytes()
+    return len(raw) - len(raw.translate(None, _B64_WHITESPACE))
+
+
+def _b64decode(data: Union[str, memoryview]) -> bytes:
+    """
+    Decode base64 with pybase64's single-pass SIMD decode+validate. Input the
+    strict decoder rejects (missing padding, MIME line breaks) is retried with
+    the lenient stdlib decoder once whitespace is dropped and the padding
+    restored. Raises binascii.Error if neither decoder accepts it.
+    """
+    try:
+        return _base64.b64decode(data, validate=True)
+    except binascii.Error:
+        if isinstance(data, str):
+            data = data.encode("ascii", "ignore")
+        else:
+            data = data.tobytes()
+        # Padding is counted over the alphabet only; line breaks would skew it
+        data = data.translate(None, _B64_WHITESPACE)
+        return base64.b64decode(data + b"=" * (-len(data) % 4))
+
+
+def read_image_header(head: Union[bytes, memoryview]) -> Tuple[str, Optional[Tuple[int, int]]]:
+    """
+    Identify a JPEG/PNG/WEBP payload from its leading bytes (bytes or memoryview).
+    Returns (format, (width, height)), with None dimensions when they lie
+    beyond the bytes provided. Raises ValueError on any other format.
+    """
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        if len(head) >= 24 and head[12:16] == b"IHDR":
+            return "PNG", struct.unpack(">II", head[16:24])
+        return "PNG", None
+
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        chunk = head[12:16]
+        if chunk == b"VP8 " and len(head) >= 30:
+            width, height = struct.unpack("<HH", head[26:30])
+            return "WEBP", (width & 0x3FFF, height & 0x3FFF)
+        if chunk == b"VP8L" and len(head) >= 25:
+            bits = int.from_bytes(head[21:25], "little")
+            return "WEBP", ((bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+        if chunk == b"VP8X" and len(head) >= 30:
+            width = int.from_bytes(head[24:27], "little") + 1
+            height = int.from_bytes(head[27:30], "little") + 1
+            return "WEBP", (width, height)
+        return "WEBP", None
+
+    if head[:2] == b"\xff\xd8":
+        # Walk the marker segments up to the first start-of-frame
+        i = 2
+        while i + 9 <= len(head):
+            if head[i] != 0xFF:
+                break
+            marker = head[i + 1]
+            if marker == 0xFF:  # fill byte
+                i += 1
+            elif marker in JPEG_SOF_MARKERS:
+                height, width = struct.unpack(">HH", head[i + 5:i + 9])
+                return "JPEG", (width, height)
+            elif marker == 0x01 or 0xD0 <= marker <= 0xD8:  # standalone markers
+                i += 2
+            else:
+                i += 2 + struct.unpack(">H", head[i + 2:i + 4])[0]
+        return "JPEG", None
+
+    raise ValueError("Unsupported image format (expected JPEG, PNG or WEBP)")
+
+
+def check_image_header(head: Union[bytes, memoryview]) -> Optional[Tuple[int, int]]:
+    """
+    Validate format, minimum dimensions and pixel count from the header alone,
+    so undersized images are rejected before PIL or OpenCV decode any pixels.
+    Returns (width, height) when known. Raises ValueError if rejected.
+    """
+    _, size = read_image_header(head)
+    if size is None:
+        return None
+
+    validate_dimensions(*size)
+    if size[0] * size[1] > settings.MAX_IMAGE_PIXELS:
+        raise ValueError(
+            f"Image too large: {size[0]}x{size[1]}px "
+            f"(max {settings.MAX_IMAGE_PIXELS} pixels)"
+        )
+    return size
+
+
+def check_image_bytes(raw_bytes: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Size, format and pixel-count checks on raw image bytes, before decoding.
+    Returns (width, height) from the header when known. Raises ValueError if rejected.
+    """
     if len(raw_bytes) > settings.MAX_IMAGE_SIZE_BYTES:
         raise ValueError(
             f"Image too large: {len(raw_bytes)} bytes "
             f"(max {settings.MAX_IMAGE_SIZE_BYTES} bytes)"
         )
+    # The decoded payload is already the only copy of the image (b64decode
+    # sizes its output exactly, BytesIO/np.frombuffer wrap it) — read the
+    # header through a memoryview so not even the header is copied. The JPEG
+    # marker walk jumps whole segments, so scanning the full buffer finds
+    # SOFs behind large APP1/APP2 (EXIF, ICC) segments at no extra cost
+    return check_image_header(memoryview(raw_bytes))
 
+
+def decode_image_bytes(raw_bytes: bytes) -> Image.Image:
+    """
+    Open raw image bytes (JPEG/PNG/WEBP) as a PIL Image.
+    Used directly by the binary endpoints, which skip base64 entirely.
+    Raises ValueError on invalid input.
+    """
+    check_image_bytes(raw_bytes)
+
+    # Only the header is parsed here; pixel data is decoded (and corrupt
+    # data detected) lazily by normalize_image. A fresh BytesIO per image is
+    # free — it shares raw_bytes' buffer instead of copying it — and the lazy
+    # decode needs it to stay untouched until then, so it isn't pooled
     try:
         img = Image.open(io.BytesIO(raw_bytes))
-        img.verify()  # Verify it's a valid image
-        # Re-open after verify (verify closes the stream)
-        img = Image.open(io.BytesIO(raw_bytes))
-    except Exception as exc:
+    except (UnidentifiedImageError, OSError) as exc:
         raise ValueError(f"Cannot decode image: {exc}") from exc
 
+    if img.format not in ALLOWED_IMAGE_FORMATS:
+        raise ValueError(f"Unsupported image format: {img.format}")
+
     return img
 
 
@@ -61,8 +277,14 @@ def validate_image(img: Image.Image) -> Tuple[int, int]:
     Returns (width, height).
     Raises ValueError on invalid images.
     """
-    width, height = img.size
+    return validate_dimensions(*img.size)
+
 
+def validate_dimensions(width: int, height: int) -> Tuple[int, int]:
+    """
+    Validate image dimensions without an Image object.
+    Returns (width, height). Raises ValueError if too small.
+    """
     if width < MIN_DIMENSION_PX or height < MIN_DIMENSION_PX:
         raise ValueError(
             f"Image too small: {width}x{height}px "
@@ -75,16 +297,25 @@ def validate_image(img: Image.Image) -> Tuple[int, int]:
 def normalize_image(img: Image.Image) -> Image.Image:
     """
     Convert to RGB (handles RGBA, grayscale, palette), apply EXIF orientation.
+    Raises ValueError if the pixel data is truncated or corrupt.
     """
-    # Apply EXIF orientation if present
-    img = ImageOps.exif_transpose(img)
+    try:
+        img.load()
+    except (OSError, SyntaxError) as exc:
+        raise ValueError(f"Cannot decode image: {exc}") from exc
+
+    # Apply EXIF orientation if present — exif_transpose copies the image even
+    # when there's nothing to do. PNG/WEBP can carry EXIF too, so check every format
+    if img.getexif().get(EXIF_ORIENTATION_TAG, 1) != 1:
+        img = ImageOps.exif_transpose(img)
 
     # Convert to RGB (3-channel)
     if img.mode != "RGB":
         if img.mode == "RGBA":
-            # Composite onto white background
+            # Composite onto white background; an RGBA mask uses its own alpha
+            # band, so there's no split() into four channel images
             background = Image.new("RGB", img.size, (255, 255, 255))
-            background.paste(img, mask=img.split()[3])  # Use alpha channel as mask
+            background.paste(img, mask=img)
             img = background
         else:
             img = img.convert("RGB")
@@ -103,8 +334,21 @@ def crop_face(
     """
     Crop face from image with optional padding, clamped to image bounds.
     """
-    width, height = img.size
+    return img.crop(face_crop_box(img.width, img.height, bbox_x, bbox_y, bbox_w, bbox_h, padding_factor))
+
 
+def face_crop_box(
+    width: int,
+    height: int,
+    bbox_x: int,
+    bbox_y: int,
+    bbox_w: int,
+    bbox_h: int,
+    padding_factor: float = 0.1,
+) -> Tuple[int, int, int, int]:
+    """
+    Padded bbox as (x1, y1, x2, y2), clamped to a width x height image.
+    """
     pad_x = int(bbox_w * padding_factor)
     pad_y = int(bbox_h * padding_factor)
 
@@ -113,25 +357,280 @@ def crop_face(
     x2 = min(width, bbox_x + bbox_w + pad_x)
     y2 = min(height, bbox_y + bbox_h + pad_y)
 
-    return img.crop((x1, y1, x2, y2))
+    return x1, y1, x2, y2
+
+
+def prepare_face_crop(
+    img: Image.Image,
+    bbox_x: int,
+    bbox_y: int,
+    bbox_w: int,
+    bbox_h: int,
+    target_size: int = 112,
+) -> np.ndarray:
+    """
+    Fused bbox path: decode → normalize → crop → resize into the model input.
+
+    `img` must not be loaded yet. For JPEGs, Image.draft lets libjpeg decode
+    at 1/2, 1/4 or 1/8 scale while keeping the face at least 2 * target_size
+    pixels, so large photos never materialize at full resolution.
+    The bbox is in full-resolution, EXIF-transposed coordinates (as /detect returns).
+    Returns float32 (target_size, target_size, 3), see resize_to_model_input.
+    """
+    return prepare_faces(img, [(bbox_x, bbox_y, bbox_w, bbox_h)], target_size)[0]
+
+
+def prepare_faces(
+    img: Image.Image,
+    bboxes: Sequence[Tuple[int, int, int, int]],
+    target_size: int = 112,
+) -> List[np.ndarray]:
+    """
+    Multi-face prepare_face_crop: decode and normalize the image once (drafted
+    for its smallest face), then crop and letterbox every (x, y, w, h) bbox,
+    in parallel on a shared thread pool when there is more than one.
+    Returns one float32 (target_size, target_size, 3) tensor per bbox, in order.
+    Raises ValueError if a bbox lies outside the image.
+    """
+    full_w, full_h = img.size
+    if img.getexif().get(EXIF_ORIENTATION_TAG, 1) in (5, 6, 7, 8):
+        full_w, full_h = full_h, full_w  # Transposed by normalize_image below
+
+    bboxes = np.asarray(bboxes, dtype=np.int64).reshape(-1, 4)
+    if img.format in ("JPEG", "MPO") and len(bboxes):
+        scale = min(1.0, 2 * target_size / max(1, int(bboxes[:, 2:].min())))
+        if scale < 1.0:
+            img.draft("RGB", (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+
+    img = normalize_image(img)
+    pixels = np.asarray(img, dtype=np.uint8)
+
+    # Map the bboxes into the (possibly draft-downscaled) decoded image
+    sx = img.width / full_w
+    sy = img.height / full_h
+    scaled = (bboxes * np.array([sx, sy, sx, sy])).astype(np.int64)
+    scaled[:, 2:] = np.maximum(scaled[:, 2:], 1)
+    boxes = face_crop_boxes(img.width, img.height, scaled).tolist()
+
+    def prepare(box: List[int]) -> np.ndarray:
+        x1, y1, x2, y2 = box
+        if x2 <= x1 or y2 <= y1:
+            raise ValueError(f"Face bbox lies outside the image ({full_w}x{full_h}px)")
+        return resize_to_model_input(pixels[y1:y2, x1:x2], target_size)
+
+    if len(boxes) <= 1:
+        return [prepare(box) for box in boxes]
+    # cv2.resize and the NumPy conversions release the GIL, so faces scale across cores
+    return list(_get_face_executor().map(prepare, boxes))
+
+
+@functools.lru_cache(maxsize=1)
+def _get_face_executor() -> ThreadPoolExecutor:
+    """Shared pool for per-face work within one image (see prepare_faces)."""
+    return ThreadPoolExecutor(
+        max_workers=settings.THREAD_POOL_SIZE or os.cpu_count() or 1,
+        thread_name_prefix="face-prep",
+    )
+
+
+def face_crop_boxes(
+    width: int,
+    height: int,
+    bboxes: np.ndarray,
+    padding_factor: float = 0.1,
+) -> np.ndarray:
+    """
+    Vectorized face_crop_box for many faces: (N, 4) int [x, y, w, h] rows
+    to (N, 4) int64 [x1, y1, x2, y2] rows, padded and clamped with one np.clip
+    (same bounds as face_crop_box: x1/y1 >= 0, x2/y2 <= width/height).
+    """
+    bboxes = np.asarray(bboxes, dtype=np.int64).reshape(-1, 4)
+    pads = (bboxes[:, 2:] * padding_factor).astype(np.int64)
+    corners = np.hstack([bboxes[:, :2] - pads, bboxes[:, :2] + bboxes[:, 2:] + pads])
+    low, high = np.iinfo(np.int64).min, np.iinfo(np.int64).max
+    return np.clip(corners, [0, 0, low, low], [high, high, width, height])
+
+
+def decode_and_prepare(
+    raw_bytes: bytes,
+    bbox_x: int,
+    bbox_y: int,
+    bbox_w: int,
+    bbox_h: int,
+    target_size: int = 112,
+) -> Optional[Tuple[np.ndarray, Tuple[int, int]]]:
+    """
+    OpenCV variant of prepare_face_crop for complete JPEG bytes.
+
+    cv2.imdecode runs libjpeg-turbo straight into a numpy array, applying EXIF
+    orientation and the same 1/2, 1/4 or 1/8 DCT scale Image.draft would pick,
+    so the crop → letterbox path never touches PIL. Returns (tensor,
+    (width, height)) with the full-resolution size from the JPEG header, or
+    None when the frame header can't be located, leaving the image to PIL.
+    Raises ValueError on invalid input.
+    """
+    size = check_image_bytes(raw_bytes)
+    if size is None:
+        return None
+    width, height = size
+
+    # Largest reduction keeping the face >= 2 * target_size px (Image.draft's rule)
+    scale = min(1.0, 2 * target_size / max(1, min(bbox_w, bbox_h)))
+    reduce = 1
+    if scale < 1.0:
+        fit = min(width // math.ceil(width * scale), height // math.ceil(height * scale))
+        reduce = next(r for r in (8, 4, 2, 1) if fit >= r)
+
+    reduced_bbox = (bbox_x // reduce, bbox_y // reduce, max(1, bbox_w // reduce), max(1, bbox_h // reduce))
+    face = None
+    if _turbojpeg is not None:
+        face = decode_jpeg_roi(raw_bytes, width, height, reduced_bbox, reduce)
+
+    if face is None:
+        bgr = cv2.imdecode(np.frombuffer(raw_bytes, dtype=np.uint8), JPEG_REDUCED_FLAGS[reduce])
+        if bgr is None:
+            raise ValueError("Cannot decode image: invalid JPEG data")
+
+        x1, y1, x2, y2 = face_crop_box(bgr.shape[1], bgr.shape[0], *reduced_bbox)
+        if x2 <= x1 or y2 <= y1:
+            raise ValueError(f"Face bbox lies outside the image ({width}x{height}px)")
+
+        # The model sees RGB on the bbox path (see prepare_face_crop)
+        face = cv2.cvtColor(bgr[y1:y2, x1:x2], cv2.COLOR_BGR2RGB)
+
+    return resize_to_model_input(face, target_size), (width, height)
+
+
+def decode_jpeg_roi(
+    raw_bytes: bytes,
+    width: int,
+    height: int,
+    reduced_bbox: Tuple[int, int, int, int],
+    reduce: int,
+) -> Optional[np.ndarray]:
+    """
+    Decode only the padded face crop of a JPEG with TurboJPEG, as RGB uint8.
+
+    `reduced_bbox` is the bbox at the 1/reduce decode scale. The JPEG is
+    losslessly cropped to the MCU-aligned region around it (plus one MCU of
+    margin, so chroma upsampling at the crop edge matches a full decode),
+    decoded at 1/reduce, and sliced to exactly the pixels decode_and_prepare's
+    full decode would crop. Returns None when that isn't possible — EXIF
+    rotation, faces in the partial MCUs at the image edge, or decoder errors —
+    and the caller falls back to a full decode.
+    """
+    try:
+        if Image.open(io.BytesIO(raw_bytes)).getexif().get(EXIF_ORIENTATION_TAG, 1) != 1:
+            return None  # The bbox is in transposed coordinates
+
+        x1, y1, x2, y2 = face_crop_box(-(-width // reduce), -(-height // reduce), *reduced_bbox)
+        if x2 <= x1 or y2 <= y1:
+            return None
+
+        subsample = _turbojpeg.decode_header(raw_bytes)[2]
+        mcu_w, mcu_h = tjMCUWidth[subsample], tjMCUHeight[subsample]
+
+        # Full-resolution crop region: MCU-aligned origin, one MCU of margin,
+        # and only whole MCUs (lossless crops can't end inside a partial one)
+        rx1 = max(0, x1 * reduce - mcu_w) // mcu_w * mcu_w
+        ry1 = max(0, y1 * reduce - mcu_h) // mcu_h * mcu_h
+        rx2 = min(x2 * reduce + mcu_w, width - width % mcu_w)
+        ry2 = min(y2 * reduce + mcu_h, height - height % mcu_h)
+        if rx2 < x2 * reduce or ry2 < y2 * reduce:
+            return None
+
+        cropped = _turbojpeg.crop(raw_bytes, rx1, ry1, rx2 - rx1, ry2 - ry1)
+        roi = _turbojpeg.decode(
+            cropped,
+            pixel_format=TJPF_RGB,
+            scaling_factor=(1, reduce) if reduce > 1 else None,
+        )
+    except (OSError, ValueError) as exc:
+        logger.debug({"msg": "TurboJPEG ROI decode failed, decoding full image", "error": str(exc)})
+        return None
+
+    ox, oy = rx1 // reduce, ry1 // reduce
+    return roi[y1 - oy:y2 - oy, x1 - ox:x2 - ox]
+
+
+def is_complete_jpeg(raw_bytes: bytes) -> bool:
+    """
+    True for JPEG bytes ending in an EOI marker. libjpeg silently pads truncated
+    files with gray, so anything else is left to PIL, which rejects them.
+    """
+    return raw_bytes[:2] == b"\xff\xd8" and raw_bytes.rstrip(b"\x00")[-2:] == b"\xff\xd9"
 
 
 def resize_for_embedding(img: Image.Image, target_size: int = 112) -> np.ndarray:
     """
     Resize image to target_size x target_size and convert to numpy array
     in the format expected by DeepFace ArcFace (112x112 RGB uint8).
+    A JPEG that isn't loaded yet is decoded at the smallest DCT scale that
+    keeps it at least 2 * target_size px (no-op once pixel data is loaded).
     """
-    img = img.resize((target_size, target_size), Image.LANCZOS)
+    if img.format in ("JPEG", "MPO"):
+        img.draft("RGB", (2 * target_size, 2 * target_size))
+    # Box averaging for real downscales, bilinear otherwise — ArcFace is
+    # insensitive to the filter at 112x112 and Lanczos costs several times more
+    resample = Image.BOX if max(img.size) > 2 * target_size else Image.BILINEAR
+    img = img.resize((target_size, target_size), resample)
     arr = np.array(img, dtype=np.uint8)
     return arr
 
 
-def image_to_numpy(img: Image.Image) -> np.ndarray:
-    """Convert PIL Image to BGR numpy array (DeepFace expectation)."""
-    rgb_array = np.array(img, dtype=np.uint8)
-    # DeepFace internals use BGR (OpenCV convention)
-    bgr_array = rgb_array[:, :, ::-1]
-    return bgr_array
+def resize_to_model_input(face: np.ndarray, target_size: int = 112) -> np.ndarray:
+    """
+    Fit a face crop into a target_size x target_size model input, preserving
+    aspect ratio with black padding (same as DeepFace's resize_image).
+    uint8 input is scaled to [0, 1]. Returns float32 (target_size, target_size, 3).
+    Strided views (crop slices, [:, :, ::-1] channel flips) are made
+    contiguous by this single conversion, before cv2 sees them.
+    """
+    if face.dtype == np.uint8:
+        face = face.astype(np.float32)
+        face /= 255.0
+    else:
+        face = np.ascontiguousarray(face, dtype=np.float32)
+
+    factor = min(target_size / face.shape[0], target_size / face.shape[1])
+    dsize = (int(face.shape[1] * factor), int(face.shape[0] * factor))
+    if dsize[0] == 0 or dsize[1] == 0:
+        raise ValueError(f"Face crop too small to resize: {face.shape[1]}x{face.shape[0]}px")
+    face = cv2.resize(face, dsize)
+
+    diff_h = target_size - face.shape[0]
+    diff_w = target_size - face.shape[1]
+    face = np.pad(
+        face,
+        ((diff_h // 2, diff_h - diff_h // 2), (diff_w // 2, diff_w - diff_w // 2), (0, 0)),
+        "constant",
+    )
+    if face.shape[:2] != (target_size, target_size):
+        face = cv2.resize(face, (target_size, target_size))
+
+    return face
+
+
+def image_to_numpy(img: Image.Image, reuse_buffer: bool = False) -> np.ndarray:
+    """
+    Convert an RGB PIL Image to a BGR numpy array (DeepFace expectation).
+    Returns a contiguous C-order BGR uint8 array suitable for cv2/DeepFace
+    without implicit re-copies. With reuse_buffer the result is written into
+    this thread's scratch buffer and only valid until the thread's next
+    reuse_buffer call — for callers that finish with the array (e.g.
+    DeepFace.extract_faces) before returning.
+    """
+    rgb_array = np.asarray(img, dtype=np.uint8)
+    # DeepFace internals use BGR (OpenCV convention); cvtColor writes a
+    # contiguous array in one SIMD pass instead of a strided [:, :, ::-1] view
+    if not reuse_buffer or img.width * img.height > BGR_SCRATCH_MAX_PIXELS:
+        return cv2.cvtColor(rgb_array, cv2.COLOR_RGB2BGR)
+
+    buffer = getattr(_bgr_scratch, "buffer", None)
+    if buffer is None or buffer.shape != rgb_array.shape:
+        buffer = np.empty(rgb_array.shape, dtype=np.uint8)
+        _bgr_scratch.buffer = buffer
+    return cv2.cvtColor(rgb_array, cv2.COLOR_RGB2BGR, dst=buffer)
 
 
 def estimate_face_quality(face_width: int, face_height: int, image_width: int, image_height: int) -> float:
@@ -143,20 +642,26 @@ def estimate_face_quality(face_width: int, face_height: int, image_width: int, i
     """
     face_area = face_width * face_height
     image_area = image_width * image_height
+    min_dim = min(face_width, face_height)
 
-    if image_area == 0:
+    # Penalize very small faces heavily
+    if image_area == 0 or min_dim < settings.MIN_FACE_SIZE_PX:
         return 0.0
 
-    area_ratio = min(face_area / image_area, 1.0)
-    min_dim = min(face_width, face_height)
+    # Quality formula: blend of area ratio and minimum dimension score, in
+    # integer basis points (1/10000), truncated — it's an opaque score, so no
+    # rounding step. Faces >= 112px get full score for the dimension component
+    area_bp = min(face_area * 10000 // image_area, 10000)
+    dim_bp = min(min_dim * 10000 // 112, 10000)
 
-    # Quality formula: blend of area ratio and minimum dimension score
-    # Faces >= 112px get full score for dimension component
-    dim_score = min(min_dim / 112.0, 1.0)
+    quality_bp = (4 * area_bp + 6 * dim_bp) // 10
+    return quality_bp / 10000
 
-    # Penalize very small faces heavily
-    if min_dim < settings.MIN_FACE_SIZE_PX:
-        return 0.0
 
-    quality = 0.4 * area_ratio + 0.6 * dim_score
-    return round(min(quality, 1.0), 4)
+def batch_estimate_face_quality(sizes: np.ndarray) -> np.ndarray:
+    """
+    estimate_face_quality for many faces in one compiled loop.
+    `sizes` is (N, 4) of [face_w, face_h, image_w, image_h]; returns (N,) float64.
+    """
+    sizes = np.ascontiguousarray(sizes, dtype=np.int64).reshape(-1, 4)
+    return face_quality_batch(sizes, settings.MIN_FACE_SIZE_PX)
@@ -0,0 +1,119 @@
+import base64
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+
+import main
+from config import settings
+from models.schemas import EMBEDDING_B64_LENGTH, CandidateRecord, MatchRequest
+
+HEADERS = {"Authorization": f"Bearer {settings.API_KEY}"}
+
+
+@pytest.fixture(scope="module")
+def client() -> TestClient:
+    return TestClient(main.app)
+
+
+def _pack(embedding: np.ndarray) -> str:
+    return base64.b64encode(embedding.astype("<f4").tobytes()).decode()
+
+
+def _embeddings(n: int) -> np.ndarray:
+    # Candidates around a shared direction, so the query has matches in every tier
+    rng = np.random.default_rng(3)
+    base = rng.standard_normal(512)
+    return (base + np.linspace(0.2, 1.5, n)[:, None] * rng.standard_normal((n, 512))).astype(np.float32)
+
+
+def _candidate(i: int, embedding: np.ndarray, packed: bool) -> dict:
+    record = {"face_embedding_id": f"fe{i}", "person_id": f"p{i}", "case_id": "c"}
+    if packed:
+        record["embedding_b64"] = _pack(embedding)
+    else:
+        record["embedding"] = embedding.tolist()
+    return record
+
+
+def _match(client, query: dict, candidates: list):
+    return client.post("/match", json={**query, "candidates": candidates, "threshold": 0.0, "max_results": 100}, headers=HEADERS)
+
+
+def test_packed_length_matches_512_float32():
+    assert len(_pack(np.zeros(512, dtype=np.float32))) == EMBEDDING_B64_LENGTH
+
+
+@pytest.mark.parametrize("forms", [{}, {"query_embedding": [0.1] * 512, "query_embedding_b64": "A" * EMBEDDING_B64_LENGTH}])
+def test_query_requires_exactly_one_form(forms):
+    with pytest.raises(ValidationError, match="exactly one of query_embedding or query_embedding_b64"):
+        MatchRequest(candidates=[], **forms)
+
+
+@pytest.mark.parametrize("forms", [{}, {"embedding": [0.1] * 512, "embedding_b64": "A" * EMBEDDING_B64_LENGTH}])
+def test_candidate_requires_exactly_one_form(client, forms):
+    with pytest.raises(ValidationError, match="exactly one of embedding or embedding_b64"):
+        CandidateRecord(face_embedding_id="fe", person_id="p", case_id="c", **forms)
+
+    query = {"query_embedding_b64": _pack(np.ones(512, dtype=np.float32))}
+    candidate = {"face_embedding_id": "fe", "person_id": "p", "case_id": "c", **forms}
+    assert _match(client, query, [candidate]).status_code == 422
+
+
+def test_float_lists_rejected_when_disabled(client, monkeypatch):
+    monkeypatch.setattr(settings, "ALLOW_FLOAT_LIST_EMBEDDINGS", False)
+    embeddings = _embeddings(2)
+    packed_query = {"query_embedding_b64": _pack(embeddings[0])}
+
+    response = _match(client, {"query_embedding": embeddings[0].tolist()}, [_candidate(0, embeddings[1], True)])
+    assert response.status_code == 422
+    assert "query_embedding as a float list is disabled" in response.text
+
+    response = _match(client, packed_query, [_candidate(0, embeddings[1], False)])
+    assert response.status_code == 422
+    assert "embedding as a float list is disabled" in response.text
+
+    assert _match(client, packed_query, [_candidate(0, embeddings[1], True)]).status_code == 200
+
+
+@pytest.mark.parametrize(
+    "packed",
+    [
+        "A" * (EMBEDDING_B64_LENGTH - 4),          # 2045 bytes
+        "A" * (EMBEDDING_B64_LENGTH + 4),          # 2051 bytes
+        "A" * EMBEDDING_B64_LENGTH,                # right length, 2049 bytes (no padding)
+        "!" * EMBEDDING_B64_LENGTH,                # not base64
+        "A" * (EMBEDDING_B64_LENGTH - 8) + "AA\nAAA==",  # line breaks aren't accepted in embeddings
+    ],
+    ids=["short", "long", "unpadded", "invalid", "whitespace"],
+)
+def test_bad_packed_embeddings_return_422(client, packed):
+    embedding = _embeddings(1)[0]
+
+    response = _match(client, {"query_embedding_b64": packed}, [_candidate(0, embedding, True)])
+    assert response.status_code == 422
+
+    query = {"query_embedding_b64": _pack(embedding)}
+    # Both the all-packed fast path and the mixed per-row path
+    for candidates in ([{**_candidate(0, embedding, True), "embedding_b64": packed}],
+                       [_candidate(0, embedding, False), {**_candidate(1, embedding, True), "embedding_b64": packed}]):
+        response = _match(client, query, candidates)
+        assert response.status_code == 422
+
+
+def test_packed_and_list_candidates_score_identically(client):
+    embeddings = _embeddings(41)
+    query, rows = embeddings[0], embeddings[1:]
+
+    responses = [
+        _match(client, {"query_embedding": query.tolist()}, [_candidate(i, e, False) for i, e in enumerate(rows)]),
+        _match(client, {"query_embedding_b64": _pack(query)}, [_candidate(i, e, True) for i, e in enumerate(rows)]),
+        _match(client, {"query_embedding_b64": _pack(query)}, [_candidate(i, e, i % 2 == 0) for i, e in enumerate(rows)]),
+    ]
+
+    assert [r.status_code for r in responses] == [200, 200, 200]
+    matches = [r.json()["matches"] for r in responses]
+    assert len(matches[0]) > 1
+    assert matches[1] == matches[0]
+    assert matches[2] == matches[0]
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from config import settings
+from models.schemas import CandidateRecord, ConfidenceTier
+from services.matcher import (
+    batch_compute_similarities,
+    match_embedding_against_candidates,
+    prepare_candidate_matrix,
+)
+
+
+def _embeddings(n: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((n, 512)).astype(np.float32)
+
+
+def _candidates(matrix: np.ndarray) -> list:
+    return [
+        CandidateRecord(face_embedding_id=f"fe{i}", person_id=f"p{i}", case_id="c", embedding=row.tolist())
+        for i, row in enumerate(matrix)
+    ]
+
+
+def test_large_candidate_sets_stay_float32_by_default():
+    prepared = prepare_candidate_matrix(_candidates(_embeddings(100)))
+
+    assert prepared.scales is None
+    assert prepared.matrix.dtype == np.float32
+
+
+def test_match_ranking_agrees_with_float32_similarities():
+    # Candidates at increasing distance from the query, so scores span every tier
+    query = _embeddings(1, seed=1)[0]
+    noise = np.linspace(0.2, 2.0, 500, dtype=np.float32)[:, None]
+    matrix = query + noise * _embeddings(500)
+    expected = np.asarray(batch_compute_similarities(query.tolist(), matrix.tolist()))
+
+    matches, _ = match_embedding_against_candidates(query.tolist(), _candidates(matrix), threshold=0.0, max_results=500)
+
+    order = [i for i in np.argsort(-expected, kind="stable") if expected[i] >= settings.THRESHOLD_LOW]
+    assert [m.face_embedding_id for m in matches] == [f"fe{i}" for i in order]
+    assert [m.similarity for m in matches] == pytest.approx(expected[order], abs=1e-6)
+    assert {m.confidence_tier for m in matches} == {ConfidenceTier.HIGH, ConfidenceTier.MEDIUM, ConfidenceTier.LOW}
@@ -0,0 +1,230 @@
+import base64
+import functools
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from config import settings
+from services import preprocessor
+from services.preprocessor import (
+    check_image_bytes,
+    check_image_header,
+    decode_and_prepare,
+    decode_base64_bytes,
+    decode_image_bytes,
+    read_image_header,
+)
+
+
+def _jpeg_bytes(width: int, height: int) -> bytes:
+    # Noise keeps the JPEG large (past the 64 KB header peek) at any size
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format="JPEG", quality=95)
+    return buf.getvalue()
+
+
+@pytest.fixture(scope="module")
+def jpeg() -> bytes:
+    raw = _jpeg_bytes(400, 300)
+    assert len(raw) > 64 * 1024
+    return raw
+
+
+def _wrap(encoded: str, columns: int, newline: str = "\n") -> str:
+    return newline.join(encoded[i:i + columns] for i in range(0, len(encoded), columns)) + newline
+
+
+@pytest.mark.parametrize("columns", [60, 64, 76])
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+def test_decode_line_wrapped_payload(jpeg, columns, newline):
+    payload = _wrap(base64.b64encode(jpeg).decode(), columns, newline)
+
+    assert decode_base64_bytes(payload) == jpeg
+    assert decode_base64_bytes(payload.encode()) == jpeg
+
+
+def test_decode_mime_encoded_payload(jpeg):
+    payload = base64.encodebytes(jpeg)
+
+    assert decode_base64_bytes(payload) == jpeg
+    assert decode_base64_bytes("data:image/jpeg;base64," + payload.decode()) == jpeg
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+def test_size_limit_ignores_line_breaks(jpeg, monkeypatch, newline):
+    monkeypatch.setattr(settings, "MAX_IMAGE_SIZE_BYTES", 100_000)
+    # Trailing bytes after EOI are never read — they only set the payload size
+    raw = jpeg[:90_000] + b"\0" * 9_002
+    encoded = base64.b64encode(raw).decode()
+
+    assert decode_base64_bytes(_wrap(encoded, 76, newline)) == raw
+    assert decode_base64_bytes(_wrap(encoded, 60, newline).encode()) == raw
+
+    too_large = base64.b64encode(raw + b"\0" * 1_000).decode()
+    with pytest.raises(ValueError, match="Image too large: 100002 bytes"):
+        decode_base64_bytes(_wrap(too_large, 76, newline))
+
+
+def test_decode_unpadded_payload():
+    raw = _jpeg_bytes(64, 64)
+    raw += b"\0" * ((1 - len(raw)) % 3)  # force "==" padding
+    encoded = base64.b64encode(raw).decode()
+    assert encoded.endswith("=")
+
+    assert decode_base64_bytes(encoded.rstrip("=")) == raw
+
+
+
+def test_decode_and_prepare_jpeg_with_large_icc_profile():
+    # A 100 KB ICC profile pushes the SOF well past any fixed header peek
+    buf = io.BytesIO()
+    Image.new("RGB", (1600, 1200), (120, 90, 60)).save(buf, format="JPEG", icc_profile=b"\0" * 100_000)
+    raw = buf.getvalue()
+
+    assert check_image_bytes(raw) == (1600, 1200)
+    tensor, size = decode_and_prepare(raw, 600, 400, 300, 300, 112)
+    assert size == (1600, 1200)
+    assert tensor.shape[-3:-1] == (112, 112)
+
+
+def test_decode_image_bytes_accepts_mpo():
+    # Multi-picture JPEGs, as written by many phone and stereo cameras
+    frames = [Image.new("RGB", (64, 64), color) for color in ((255, 0, 0), (0, 0, 255))]
+    buf = io.BytesIO()
+    frames[0].save(buf, format="MPO", save_all=True, append_images=frames[1:])
+
+    img = decode_image_bytes(buf.getvalue())
+    assert img.format == "MPO"
+    assert img.size == (64, 64)
+
+
+@functools.lru_cache(maxsize=None)
+def _photo_jpeg(width: int, height: int, mode: str = "RGB", subsampling: int = 2) -> bytes:
+    # Smooth gradients plus noise, so chroma upsampling at crop edges shows up
+    rng = np.random.default_rng(1)
+    yy, xx = np.mgrid[0:height, 0:width]
+    pixels = np.stack([xx * 255 // width, yy * 255 // height, (xx + yy) % 256], axis=-1)
+    pixels = np.clip(pixels + rng.integers(-40, 40, pixels.shape), 0, 255).astype(np.uint8)
+    img = Image.fromarray(pixels).convert(mode)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90, **({"subsampling": subsampling} if mode == "RGB" else {}))
+    return buf.getvalue()
+
+
+@pytest.mark.skipif(preprocessor._turbojpeg is None, reason="TurboJPEG / libturbojpeg not installed")
+@pytest.mark.parametrize("mode, subsampling", [("RGB", 2), ("RGB", 1), ("RGB", 0), ("L", 0)], ids=["420", "422", "444", "gray"])
+@pytest.mark.parametrize(
+    # roi: whether the TurboJPEG crop path applies, or falls back to a full decode
+    "size, bbox, reduce, roi",
+    [
+        ((1001, 803), (15, 16, 150, 150), 1, True),       # origin just inside the first MCU
+        ((1001, 803), (16, 17, 200, 180), 1, True),       # on / just past an MCU boundary
+        ((1001, 803), (840, 630, 150, 150), 1, False),    # reaches the partial edge MCUs
+        ((1001, 803), (231, 97, 460, 470), 2, True),
+        ((1001, 803), (500, 300, 480, 490), 2, False),    # padded crop clamped at the edge
+        ((2000, 1900), (63, 49, 900, 1000), 4, True),
+        ((2600, 2400), (301, 257, 1800, 1800), 8, True),
+        ((2000, 1900), (100, 50, 1800, 1800), 8, False),
+    ],
+)
+def test_turbojpeg_roi_matches_full_decode(monkeypatch, mode, subsampling, size, bbox, reduce, roi):
+    raw = _photo_jpeg(*size, mode=mode, subsampling=subsampling)
+    roi_results = []
+
+    def spy(*args):
+        roi = decode_jpeg_roi(*args)
+        roi_results.append((args[-1], roi is not None))
+        return roi
+
+    decode_jpeg_roi = preprocessor.decode_jpeg_roi
+    monkeypatch.setattr(preprocessor, "decode_jpeg_roi", spy)
+    tensor, roi_size = decode_and_prepare(raw, *bbox, 112)
+
+    monkeypatch.setattr(preprocessor, "_turbojpeg", None)
+    expected, full_size = decode_and_prepare(raw, *bbox, 112)
+
+    assert roi_results == [(reduce, roi)]
+    assert roi_size == full_size == size
+    np.testing.assert_array_equal(tensor, expected)
+
+
+def _encode(size, mode: str = "RGB", **save_kwargs) -> bytes:
+    rng = np.random.default_rng(2)
+    channels = {"L": 1, "RGB": 3, "RGBA": 4}[mode]
+    pixels = rng.integers(0, 256, (size[1], size[0], channels), dtype=np.uint8).squeeze()
+    buf = io.BytesIO()
+    Image.fromarray(pixels, mode).save(buf, **save_kwargs)
+    return buf.getvalue()
+
+
+def _exif() -> bytes:
+    exif = Image.Exif()
+    exif[0x010F] = "ReunIA test camera"
+    return exif.tobytes()
+
+
+HEADER_CASES = [
+    # (id, mode, save kwargs, bytes 12:16 for WebP chunk type)
+    ("png", "RGB", {"format": "PNG"}, None),
+    ("png-rgba", "RGBA", {"format": "PNG"}, None),
+    ("webp-lossy", "RGB", {"format": "WEBP", "quality": 80}, b"VP8 "),
+    ("webp-lossless", "RGB", {"format": "WEBP", "lossless": True}, b"VP8L"),
+    ("webp-rgba", "RGBA", {"format": "WEBP", "quality": 80}, b"VP8X"),
+    ("webp-exif", "RGB", {"format": "WEBP", "quality": 80, "exif": _exif()}, b"VP8X"),
+    ("jpeg-baseline", "RGB", {"format": "JPEG"}, None),
+    ("jpeg-progressive", "RGB", {"format": "JPEG", "progressive": True}, None),
+    ("jpeg-gray", "L", {"format": "JPEG"}, None),
+    ("jpeg-exif", "RGB", {"format": "JPEG", "exif": _exif()}, None),
+]
+
+
+@pytest.mark.parametrize("size", [(123, 77), (2049, 65)], ids=["small", "wide"])
+@pytest.mark.parametrize("mode, save_kwargs, webp_chunk", [c[1:] for c in HEADER_CASES], ids=[c[0] for c in HEADER_CASES])
+def test_read_image_header(size, mode, save_kwargs, webp_chunk):
+    raw = _encode(size, mode, **save_kwargs)
+    if webp_chunk is not None:
+        assert raw[12:16] == webp_chunk
+
+    assert read_image_header(raw) == (save_kwargs["format"], size)
+    assert read_image_header(memoryview(raw)) == (save_kwargs["format"], size)
+    assert check_image_header(raw) == size
+
+
+@pytest.mark.parametrize("fmt", ["PNG", "WEBP", "JPEG"])
+def test_read_image_header_truncated(fmt):
+    raw = _encode((123, 77), format=fmt, exif=_exif())
+
+    assert read_image_header(raw[:12]) == (fmt, None)
+    assert check_image_header(raw[:12]) is None
+
+
+def test_read_image_header_rejects_other_formats():
+    with pytest.raises(ValueError, match="Unsupported image format"):
+        read_image_header(_encode((123, 77), format="GIF"))
+
+
+@pytest.mark.parametrize("fmt", ["PNG", "WEBP", "JPEG"])
+def test_check_image_header_rejects_too_many_pixels(monkeypatch, fmt):
+    monkeypatch.setattr(settings, "MAX_IMAGE_PIXELS", 123 * 77 - 1)
+    raw = _encode((123, 77), format=fmt)
+
+    with pytest.raises(ValueError, match="Image too large: 123x77px"):
+        check_image_header(raw)
+    with pytest.raises(ValueError, match="Image too large: 123x77px"):
+        decode_base64_bytes(base64.b64encode(raw))
+
+
+@pytest.mark.parametrize("fmt", ["PNG", "WEBP", "JPEG"])
+@pytest.mark.parametrize("size", [(47, 200), (200, 47)])
+def test_check_image_header_rejects_undersized_images(fmt, size):
+    raw = _encode(size, format=fmt)
+
+    with pytest.raises(ValueError, match=f"Image too small: {size[0]}x{size[1]}px"):
+        check_image_header(raw)
+    with pytest.raises(ValueError, match="Image too small"):
+        decode_image_bytes(raw)
+    assert check_image_header(_encode((48, 48), format=fmt)) == (48, 48)